@@ -8,6 +8,7 @@ import cv2
 import pyttsx3
 
 from shared.parse_camera_settings import parse_camera_settings
+from test.synthetic_video_capture import Synthetic_cv2_VideoCapture
 from test.test_video_capture import Test_cv2_VideoCapture
 from .classifier import Classifier
 from .image_filter import ImageFilter
@@ -29,13 +30,15 @@ def camera_stream(
     terminate: Event,
     cam_stream: str,
     filter: ImageFilter,
-    test: bool = False,
+    test: str = None,
 ):
 
     rtsp_url = parse_camera_settings(cam_stream)
 
-    if test:
-        cap = Test_cv2_VideoCapture(rtsp_url, test_mode="humanoids")
+    if test == "synthetic":
+        cap = Synthetic_cv2_VideoCapture(rtsp_url)
+    elif test:
+        cap = Test_cv2_VideoCapture(rtsp_url, test_mode=test)
     else:
         cap = cv2.VideoCapture(rtsp_url)
 
@@ -87,7 +90,7 @@ def processing_stream(incoming_frames: Queue, classifier: Classifier):
     logging.info("Processing thread terminated")
 
 
-def main(test: bool = False):
+def main(test: str = None):
     frame_queue = Queue(maxsize=1)
     terminate_event = Event()
 
@@ -126,9 +129,11 @@ if __name__ == "__main__":
     parser.add_argument(
         "--test",
         "-t",
-        action="store_true",
-        default=False,
-        help="Use mockup camera to test functionality",
+        nargs="?",
+        const="humanoids",
+        default=None,
+        choices=["humanoids", "gradient", "synthetic"],
+        help="Use mockup camera to test functionality. Default mode: humanoids",
     )
 
     args = parser.parse_args()
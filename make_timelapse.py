@@ -1,45 +1,27 @@
 import argparse
-from collections import defaultdict
-from datetime import timedelta
-from glob import glob
-from pathlib import Path
-from zoneinfo import ZoneInfo
-import cv2
 
-from video.video_template import VideoTemplate, filename_to_date
+from shared.frame_archive import read_image
+from shared.frame_index import FrameIndex
+from video.deflicker import default_window
+from video.frame_cache import FrameCache, default_cache_size_gb
+from video.frame_selection import FrameSelection, parse_date
+from video.video_template import OutputSpec, VideoTemplate, default_workers
 
 default_fps = 24
 default_timezone = "Europe/Oslo"
 default_daily_time = "12:00"
 
 
-def select_daily_frames(images, target_time: str, timezone: str):
-    """Return one image per day: the frame closest to target_time in standard (winter) time.
-
-    Timestamps recorded during DST (summer) are shifted back one hour before
-    comparison so the selection is always relative to standard time.
-    """
-    tz = ZoneInfo(timezone)
-    target_h, target_m = (int(x) for x in target_time.split(":"))
-    target_seconds = target_h * 3600 + target_m * 60
-
-    by_day = defaultdict(list)
-    for img in images:
-        dt = filename_to_date(img)
-        aware = dt.replace(tzinfo=tz)
-        if aware.dst() != timedelta(0):
-            dt = dt - timedelta(hours=1)
-        by_day[dt.date()].append((dt, img))
-
-    result = []
-    for date in sorted(by_day):
-        frames = by_day[date]
-        closest = min(
-            frames,
-            key=lambda x: abs(x[0].hour * 3600 + x[0].minute * 60 + x[0].second - target_seconds),
-        )
-        result.append(closest[1])
-    return result
+def parse_output_spec(values):
+    """Return OutputSpec of command line values PATH [WIDTH HEIGHT [FPS]]"""
+    if len(values) not in (1, 3, 4):
+        raise ValueError(f"Expected PATH [WIDTH HEIGHT [FPS]], got {' '.join(values)}")
+    path, *rest = values
+    return OutputSpec(
+        video_path=path,
+        output_resolution=(int(rest[0]), int(rest[1])) if rest else None,
+        fps=float(rest[2]) if len(rest) == 3 else None,
+    )
 
 
 def make_timelapse_from_folder(
@@ -50,17 +32,37 @@ def make_timelapse_from_folder(
     daily: bool,
     daily_time: str,
     timezone: str,
+    workers: int = default_workers,
+    cache_size_gb: float = None,
+    incremental: bool = False,
+    per_day: int = None,
+    every_minutes: float = None,
+    start: str = None,
+    end: str = None,
+    deflicker: int = None,
+    outputs: list[OutputSpec] = None,
 ):
-    images = sorted(glob(str(Path(folder) / "*.png")), key=lambda f: filename_to_date(f))
+    selection = FrameSelection(
+        start=parse_date(start) if start else None,
+        end=parse_date(end) if end else None,
+        daily_time=daily_time if daily else None,
+        per_day=per_day,
+        every_minutes=every_minutes,
+        timezone=timezone,
+    )
+    with FrameIndex(folder) as index:
+        index.refresh()
+        images, dates = index.frame_times(selection.start, selection.end)
 
     if not images:
-        raise FileNotFoundError(f"No PNG images found in {folder}")
+        raise FileNotFoundError(f"No images found in {folder}")
 
-    if daily:
-        images = select_daily_frames(images, target_time=daily_time, timezone=timezone)
-        print(f"Selected {len(images)} daily frames at {daily_time} ({timezone} standard time)")
+    images = selection.select(images, dates)
+    if not images:
+        raise FileNotFoundError(f"No images selected in {folder}")
+    print(f"Selected {len(images)} frames: {selection}")
 
-    first_frame = cv2.imread(images[0])
+    first_frame = read_image(images[0])
     height, width = first_frame.shape[:2]
     resolution = (width, height)
 
@@ -70,15 +72,24 @@ def make_timelapse_from_folder(
         input_resolution=resolution,
         input_resolution_fixed=True,
         output_resolution=resolution,
+        workers=workers,
+        deflicker=deflicker,
+        frame_cache=(
+            FrameCache(max_bytes=int(cache_size_gb * 1024**3))
+            if cache_size_gb
+            else None
+        ),
+    )
+    template.render_video(
+        video_path=output, preview=preview, incremental=incremental, outputs=outputs
     )
-    template.render_video(video_path=output, preview=preview)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Create a timelapse movie from a folder of timestamped images"
     )
-    parser.add_argument("folder", help="Folder containing PNG images")
+    parser.add_argument("folder", help="Folder containing PNG, JPEG or WebP images")
     parser.add_argument("output", help="Output video file path (e.g. timelapse.mp4)")
     parser.add_argument(
         "--fps",
@@ -101,6 +112,32 @@ if __name__ == "__main__":
         default=False,
         help="Select one frame per day closest to --time",
     )
+    parser.add_argument(
+        "--per-day",
+        "-n",
+        type=int,
+        default=None,
+        metavar="N",
+        help="Select N frames per day, closest to evenly spaced times of day",
+    )
+    parser.add_argument(
+        "--every",
+        "-e",
+        type=float,
+        default=None,
+        metavar="MINUTES",
+        help="Select frames closest to a constant time step, skipping steps without frames",
+    )
+    parser.add_argument(
+        "--start",
+        default=None,
+        help="Use frames captured from this time (YYYY-mm-DD[-HH[-MM[-SS]]])",
+    )
+    parser.add_argument(
+        "--end",
+        default=None,
+        help="Use frames captured before this time (YYYY-mm-DD[-HH[-MM[-SS]]])",
+    )
     parser.add_argument(
         "--time",
         "-t",
@@ -114,6 +151,53 @@ if __name__ == "__main__":
         help=f"Timezone for DST conversion. Default: {default_timezone}",
     )
 
+    parser.add_argument(
+        "--workers",
+        "-w",
+        type=int,
+        default=default_workers,
+        help=f"Number of threads processing frames. Default: {default_workers}",
+    )
+
+    parser.add_argument(
+        "--cache",
+        "-c",
+        type=float,
+        nargs="?",
+        const=default_cache_size_gb,
+        default=None,
+        metavar="SIZE_GB",
+        help=f"Cache processed frames on disk, so that rendering again with the same geometry skips decoding. Default size: {default_cache_size_gb} GB",
+    )
+
+    parser.add_argument(
+        "--deflicker",
+        type=int,
+        nargs="?",
+        const=default_window,
+        default=None,
+        metavar="WINDOW",
+        help=f"Correct brightness of each frame towards the median of WINDOW frames around it. Default window: {default_window}",
+    )
+
+    parser.add_argument(
+        "--also",
+        "-a",
+        nargs="+",
+        action="append",
+        default=[],
+        metavar="PATH",
+        help="Also render to video PATH, optionally followed by WIDTH HEIGHT [FPS], from the same decoded frames, e.g. a small gif. May be repeated",
+    )
+
+    parser.add_argument(
+        "--incremental",
+        "-i",
+        action="store_true",
+        default=False,
+        help="Render only images added since the last render, and append them to the video without re-encoding. Requires ffmpeg, not available for gif",
+    )
+
     args = parser.parse_args()
     make_timelapse_from_folder(
         folder=args.folder,
@@ -123,4 +207,13 @@ if __name__ == "__main__":
         daily=args.daily,
         daily_time=args.time,
         timezone=args.timezone,
+        workers=args.workers,
+        cache_size_gb=args.cache,
+        incremental=args.incremental,
+        per_day=args.per_day,
+        every_minutes=args.every,
+        start=args.start,
+        end=args.end,
+        deflicker=args.deflicker,
+        outputs=[parse_output_spec(values) for values in args.also],
     )
\ No newline at end of file
@@ -0,0 +1,251 @@
+import os
+import re
+import tarfile
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from datetime import datetime
+from glob import glob
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+"""
+Per-day frame archives, replacing thousands of loose image files.
+
+Images of one day are appended to an uncompressed tar file
+<folder>/<folder>-<YYYY-MM-DD>.tar, with thumbnails as members reduced_<f>/<name>.
+A sidecar index <archive>.idx holds name, data offset and size of each member,
+so frames are read without parsing the tar file. Images inside an archive are
+referred to as <archive>/<name>, which works with reduced_image_path and
+filename_to_date like a path to a loose image.
+"""
+
+archive_extension = ".tar"
+index_extension = ".idx"
+# Number of archive indices kept in memory by open_archive
+max_open_archives = 64
+
+_archive_ref_pattern = re.compile(r"^(.*\.tar)[\\/](.+)$")
+
+
+def archive_name(description: str, timestamp: float = None):
+    date_str = time.strftime("%Y-%m-%d", time.localtime(timestamp))
+    return f"{description}-{date_str}{archive_extension}"
+
+
+def split_archive_ref(ref):
+    """Return archive path and member name of an image inside an archive, otherwise None"""
+    match = _archive_ref_pattern.match(str(ref))
+    if match is None:
+        return None
+    archive, member = match.groups()
+    return archive, member.replace("\\", "/")
+
+
+# Member names end with the capture time, as written by ImageWriter
+def member_date(name):
+    return datetime.strptime(Path(name).stem[-19:], "%Y-%m-%d-%H-%M-%S")
+
+
+def rebuild_index(path):
+    """Write index of an archive from its tar headers, e.g. for archives made with tar"""
+    with tarfile.open(path) as tar:
+        lines = [
+            f"{member.name},{member.offset_data},{member.size}\n"
+            for member in tar
+            if member.isfile()
+        ]
+    tmp_path = f"{path}{index_extension}.tmp"
+    with open(tmp_path, "w") as f:
+        f.writelines(lines)
+    os.replace(tmp_path, f"{path}{index_extension}")
+
+
+def _load_index(path):
+    members = {}
+    index_path = f"{path}{index_extension}"
+    if not os.path.isfile(index_path):
+        rebuild_index(path)
+    with open(index_path) as f:
+        for line in f:
+            # Skip a partial line left by an interrupted write
+            if not line.endswith("\n"):
+                break
+            name, offset, size = line.rstrip("\n").rsplit(",", 2)
+            members[name] = (int(offset), int(size))
+    return members
+
+
+class FrameArchive:
+    """
+    Read access to a per-day frame archive.
+
+    Attributes:
+        path: Path to tar file
+        names: Member names of full size images, in chronological order
+        dates: Capture time of each name
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._members = _load_index(self.path)
+        # Thumbnails are members in sub folders
+        self.names = sorted(
+            (name for name in self._members if "/" not in name), key=member_date
+        )
+        self.dates = [member_date(name) for name in self.names]
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self._members
+
+    # Yield references to full size images, usable as VideoTemplate.images
+    def __iter__(self):
+        for name in self.names:
+            yield os.path.join(self.path, name)
+
+    def read_bytes(self, name):
+        offset, size = self._members[name]
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            return f.read(size)
+
+    def read(self, name, flags=cv2.IMREAD_COLOR):
+        data = np.frombuffer(self.read_bytes(name), dtype=np.uint8)
+        return cv2.imdecode(data, flags)
+
+    def nearest(self, date: datetime):
+        """Return name of the image captured closest to date"""
+        if not self.names:
+            raise ValueError(f"No images in {self.path}")
+        index = bisect_left(self.dates, date)
+        candidates = [i for i in (index - 1, index) if 0 <= i < len(self.names)]
+        best = min(candidates, key=lambda i: abs(self.dates[i] - date))
+        return self.names[best]
+
+
+_archives = OrderedDict()
+_archives_lock = threading.Lock()
+
+
+def open_archive(path, refresh: bool = False):
+    """Return FrameArchive of path, with indices of recently used archives kept in memory"""
+    path = str(path)
+    with _archives_lock:
+        if not refresh and path in _archives:
+            _archives.move_to_end(path)
+            return _archives[path]
+    archive = FrameArchive(path)
+    with _archives_lock:
+        _archives[path] = archive
+        _archives.move_to_end(path)
+        while len(_archives) > max_open_archives:
+            _archives.popitem(last=False)
+    return archive
+
+
+def find_archive_images(folder):
+    """Return references to all full size images in archives in folder"""
+    return [
+        ref
+        for path in sorted(glob(str(Path(folder) / f"*{archive_extension}")))
+        for ref in open_archive(path, refresh=True)
+    ]
+
+
+def find_frame(folder, date: datetime):
+    """Return reference to the archived image captured closest to date, within the same day"""
+    paths = glob(str(Path(folder) / f"*-{date:%Y-%m-%d}{archive_extension}"))
+    if not paths:
+        raise FileNotFoundError(f"No archive for {date:%Y-%m-%d} in {folder}")
+    archive = open_archive(paths[0])
+    return os.path.join(archive.path, archive.nearest(date))
+
+
+def read_image(ref, flags=cv2.IMREAD_COLOR):
+    """Read a loose image file or an image inside an archive"""
+    archived = split_archive_ref(ref)
+    if archived is None:
+        return cv2.imread(str(ref), flags)
+    archive, member = archived
+    return open_archive(archive).read(member, flags)
+
+
+def image_exists(ref):
+    archived = split_archive_ref(ref)
+    if archived is None:
+        return os.path.isfile(ref)
+    archive, member = archived
+    return os.path.isfile(archive) and member in open_archive(archive)
+
+
+# Members are never rewritten, so their position identifies their content
+def image_version(ref):
+    """Return a string that changes when the image at ref is rewritten"""
+    archived = split_archive_ref(ref)
+    if archived is None:
+        stat = os.stat(ref)
+        return f"{stat.st_mtime_ns}-{stat.st_size}"
+    archive, member = archived
+    offset, size = open_archive(archive)._members[member]
+    return f"{offset}-{size}"
+
+
+class FrameArchiveWriter:
+    """
+    Append encoded images to an archive and its index.
+
+    The file is a valid tar file after each append, as the end of archive
+    marker is rewritten after the new member. The index line is written last,
+    so members of an interrupted write are never referenced, and are
+    overwritten by the next append. Safe to call from several threads.
+
+    Attributes:
+        path: Path to tar file
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._lock = threading.Lock()
+        self._end = None
+
+    # Offset after last indexed member, where the next member is written
+    def _find_end(self):
+        if not os.path.isfile(self.path):
+            if os.path.isfile(f"{self.path}{index_extension}"):
+                os.remove(f"{self.path}{index_extension}")
+            return 0
+        members = _load_index(self.path)
+        if not members:
+            return 0
+        offset, size = max(members.values())
+        return offset + -(-size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+
+    def append(self, name: str, data: bytes):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = time.time()
+        info.mode = 0o644
+        header = info.tobuf(format=tarfile.GNU_FORMAT)
+        padding = -len(data) % tarfile.BLOCKSIZE
+
+        with self._lock:
+            # Archive may have been removed, e.g. after downloading
+            if self._end is None or not os.path.isfile(self.path):
+                self._end = self._find_end()
+            with open(self.path, "r+b" if os.path.isfile(self.path) else "wb") as f:
+                f.seek(self._end)
+                f.write(header)
+                f.write(data)
+                f.write(bytes(padding + 2 * tarfile.BLOCKSIZE))
+                f.truncate()
+            data_offset = self._end + len(header)
+            with open(f"{self.path}{index_extension}", "a") as f:
+                f.write(f"{name},{data_offset},{len(data)}\n")
+            self._end = data_offset + len(data) + padding
+        return True
@@ -0,0 +1,338 @@
+import hashlib
+import io
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from .frame_archive import (
+    archive_extension,
+    index_extension,
+    open_archive,
+    split_archive_ref,
+)
+from .image_files import filename_to_date, image_extensions
+
+"""
+Persistent index of the frames in an image folder.
+
+One SQLite database per folder, in ~/cache/frame-index, holds name, capture
+time, file size, dimensions and modification time of each full size image,
+loose or inside a per-day archive. File names are parsed once, when a frame is
+added, so that frames in a time range are found without listing and parsing
+the whole folder. refresh lists the folder only if its modification time has
+changed, and an archive only if its index has grown. Images rewritten in place
+under the same name are not detected.
+"""
+
+logger = logging.getLogger(__name__)
+
+default_index_dir = Path(os.path.expanduser("~")) / "cache" / "frame-index"
+# Increase when the schema changes, so that indices of older versions are rebuilt
+index_version = 1
+# A folder modified this recently may change again without a new modification
+#   time, so it is listed again on the next refresh
+racy_interval_s = 2
+# Source of loose images in sources table
+_folder_source = "."
+
+_schema = """
+CREATE TABLE IF NOT EXISTS frames (
+    name TEXT PRIMARY KEY,
+    archive TEXT,
+    date TEXT NOT NULL,
+    size INTEGER,
+    width INTEGER,
+    height INTEGER,
+    mtime REAL
+);
+CREATE INDEX IF NOT EXISTS frames_date ON frames (date);
+CREATE TABLE IF NOT EXISTS sources (
+    name TEXT PRIMARY KEY,
+    mtime_ns INTEGER,
+    size INTEGER
+);
+"""
+
+
+def _image_size(source):
+    """Return width and height read from the image header, or None, None if unreadable"""
+    try:
+        with Image.open(source) as image:
+            return image.size
+    except OSError:
+        return None, None
+
+
+def _date_str(date: datetime):
+    return date.isoformat(sep=" ")
+
+
+class FrameIndex:
+    """
+    Index of the full size images in a folder, kept in an SQLite database.
+
+    Frames are referred to by path, as in VideoTemplate.images, or for archived
+    frames by <archive>/<name>, see shared.frame_archive. Safe to use from
+    several threads and processes.
+
+    Attributes:
+        folder: Image folder
+        index_path: Path to database
+    """
+
+    def __init__(self, folder, index_dir: Path = default_index_dir):
+        self.folder = str(Path(folder))
+        # Named by folder, made unique by its absolute path
+        folder_hash = hashlib.sha1(os.path.abspath(self.folder).encode()).hexdigest()
+        self.index_path = (
+            Path(index_dir) / f"{Path(self.folder).name}-{folder_hash[:12]}.sqlite"
+        )
+        os.makedirs(index_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            self.index_path, timeout=30, check_same_thread=False
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        with self._db:
+            if self._db.execute("PRAGMA user_version").fetchone()[0] != index_version:
+                self._db.execute("DROP TABLE IF EXISTS frames")
+                self._db.execute("DROP TABLE IF EXISTS sources")
+                self._db.execute(f"PRAGMA user_version={index_version}")
+            self._db.executescript(_schema)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM frames").fetchone()[0]
+
+    def close(self):
+        self._db.close()
+
+    # Name relative to folder, as stored in index
+    def _name(self, image):
+        archived = split_archive_ref(image)
+        if archived is None:
+            return os.path.basename(image)
+        archive, member = archived
+        return f"{os.path.basename(archive)}/{member}"
+
+    def _path(self, name):
+        return os.path.join(self.folder, name)
+
+    def add(self, image, width: int = None, height: int = None):
+        """Add image just written, e.g. by ImageWriter. Dimensions are read if not given"""
+        name = self._name(image)
+        archived = split_archive_ref(image)
+        date = filename_to_date(os.path.basename(name))
+        size, mtime = None, None
+        if archived is None:
+            stat = os.stat(image)
+            size, mtime = stat.st_size, stat.st_mtime
+        # Archive indices are loaded on refresh, which also fills in sizes of archived frames
+        if width is None or height is None:
+            width, height = _image_size(image) if archived is None else (None, None)
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO frames VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    name,
+                    os.path.basename(archived[0]) if archived else None,
+                    _date_str(date),
+                    size,
+                    width,
+                    height,
+                    mtime,
+                ),
+            )
+
+    def refresh(self):
+        """Add new frames and remove deleted ones, parsing only frames not indexed yet"""
+        with self._lock, self._db:
+            if not os.path.isdir(self.folder):
+                self._db.execute("DELETE FROM frames")
+                self._db.execute("DELETE FROM sources")
+                return
+            folder_stat = os.stat(self.folder)
+            if self._changed(_folder_source, folder_stat):
+                archives = self._refresh_folder()
+                self._set_source(_folder_source, folder_stat)
+            else:
+                archives = [
+                    name
+                    for (name,) in self._db.execute("SELECT name FROM sources")
+                    if name != _folder_source
+                ]
+            for archive in archives:
+                path = self._path(archive)
+                index_path = f"{path}{index_extension}"
+                stat = os.stat(index_path if os.path.isfile(index_path) else path)
+                if self._changed(archive, stat):
+                    self._refresh_archive(archive)
+                    self._set_source(archive, stat)
+
+    def _changed(self, source, stat):
+        row = self._db.execute(
+            "SELECT mtime_ns, size FROM sources WHERE name = ?", (source,)
+        ).fetchone()
+        return row != (stat.st_mtime_ns, stat.st_size)
+
+    def _set_source(self, source, stat):
+        mtime_ns = stat.st_mtime_ns
+        if time.time() - stat.st_mtime < racy_interval_s:
+            mtime_ns = None
+        self._db.execute(
+            "INSERT OR REPLACE INTO sources VALUES (?, ?, ?)",
+            (source, mtime_ns, stat.st_size),
+        )
+
+    # Index new loose images and remove deleted ones. Returns names of archives in folder
+    def _refresh_folder(self):
+        known = {
+            name
+            for (name,) in self._db.execute(
+                "SELECT name FROM frames WHERE archive IS NULL"
+            )
+        }
+        archives = []
+        new_frames = []
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if entry.name.endswith(archive_extension) and entry.is_file():
+                    archives.append(entry.name)
+                elif entry.name.endswith(image_extensions) and entry.is_file():
+                    if entry.name in known:
+                        known.discard(entry.name)
+                        continue
+                    try:
+                        date = filename_to_date(entry.name)
+                    except Exception:
+                        continue
+                    stat = entry.stat()
+                    width, height = _image_size(entry.path)
+                    new_frames.append(
+                        (
+                            entry.name,
+                            None,
+                            _date_str(date),
+                            stat.st_size,
+                            width,
+                            height,
+                            stat.st_mtime,
+                        )
+                    )
+        self._db.executemany(
+            "INSERT OR REPLACE INTO frames VALUES (?, ?, ?, ?, ?, ?, ?)", new_frames
+        )
+        self._db.executemany(
+            "DELETE FROM frames WHERE name = ?", [(name,) for name in known]
+        )
+
+        # Frames of deleted archives
+        removed = {
+            name
+            for (name,) in self._db.execute("SELECT name FROM sources")
+            if name != _folder_source
+        } - set(archives)
+        for archive in removed:
+            self._db.execute("DELETE FROM frames WHERE archive = ?", (archive,))
+            self._db.execute("DELETE FROM sources WHERE name = ?", (archive,))
+        if new_frames or known or removed:
+            logger.info(
+                f"Index of {self.folder}: {len(new_frames)} frames added, "
+                f"{len(known)} removed, {len(removed)} archives removed"
+            )
+        return archives
+
+    def _refresh_archive(self, archive_name):
+        archive = open_archive(self._path(archive_name), refresh=True)
+        known = dict(
+            self._db.execute(
+                "SELECT name, size FROM frames WHERE archive = ?", (archive_name,)
+            )
+        )
+        new_frames = []
+        sizes = []
+        for member, date in zip(archive.names, archive.dates):
+            name = f"{archive_name}/{member}"
+            size = archive._members[member][1]
+            if name in known:
+                if known.pop(name) is None:
+                    sizes.append((size, name))
+                continue
+            width, height = _image_size(io.BytesIO(archive.read_bytes(member)))
+            new_frames.append(
+                (name, archive_name, _date_str(date), size, width, height, None)
+            )
+        self._db.executemany(
+            "INSERT OR REPLACE INTO frames VALUES (?, ?, ?, ?, ?, ?, ?)", new_frames
+        )
+        self._db.executemany("UPDATE frames SET size = ? WHERE name = ?", sizes)
+        self._db.executemany(
+            "DELETE FROM frames WHERE name = ?", [(name,) for name in known]
+        )
+
+    # Names and capture times as stored, of frames captured from start until end
+    def _query(self, start: datetime = None, end: datetime = None):
+        conditions, values = [], []
+        if start is not None:
+            conditions.append("date >= ?")
+            values.append(_date_str(start))
+        if end is not None:
+            conditions.append("date < ?")
+            values.append(_date_str(end))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._lock:
+            return self._db.execute(
+                f"SELECT name, date FROM frames {where} ORDER BY date, name", values
+            ).fetchall()
+
+    def frames(self, start: datetime = None, end: datetime = None):
+        """Return image and capture time of frames captured from start until end,
+        in chronological order"""
+        return [
+            (self._path(name), datetime.fromisoformat(date))
+            for name, date in self._query(start, end)
+        ]
+
+    # NumPy parses the stored ISO dates much faster than creating datetime objects
+    def frame_times(self, start: datetime = None, end: datetime = None):
+        """Return images captured from start until end, in chronological order,
+        and their capture times as an array of numpy.datetime64"""
+        rows = self._query(start, end)
+        images = [self._path(name) for name, _ in rows]
+        return images, np.array([date for _, date in rows], dtype="datetime64[s]")
+
+    def images(self, start: datetime = None, end: datetime = None):
+        """Return images captured from start until end, in chronological order"""
+        return [image for image, _ in self.frames(start, end)]
+
+    def resolution(self, image):
+        """Return width and height of an indexed image, or None if not known"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT width, height FROM frames WHERE name = ?", (self._name(image),)
+            ).fetchone()
+        if row is None or None in row:
+            return None
+        return row
+
+
+def find_indexed_frames(folder, start: datetime = None, end: datetime = None):
+    """Return image and capture time of frames in folder captured from start until end,
+    in chronological order, after bringing the index of folder up to date"""
+    with FrameIndex(folder) as index:
+        index.refresh()
+        return index.frames(start, end)
@@ -0,0 +1,31 @@
+import os
+import re
+from datetime import datetime
+
+# File formats written by ImageWriter
+image_extensions = (".png", ".jpg", ".webp")
+
+# Downscaling factors of stored thumbnails, matching OpenCV's reduced decoding modes
+reduction_factors = (2, 4, 8)
+
+# Sub folder of the image folder holding one folder per burst, see timelapse.burst_recorder
+bursts_dir = "bursts"
+
+
+def filename_to_date(filename):
+    pattern = r"(\d{4}-\d{2}-\d{2}-\d{2}-\d{2}-\d{2})"
+    match = re.search(pattern, filename)
+    if match:
+        date_str = match.group(1)
+        return datetime.strptime(date_str, "%Y-%m-%d-%H-%M-%S")
+    raise Exception(f"Cannot parse date from file name: {filename}")
+
+
+def reduced_dir_name(factor: int):
+    return f"reduced_{factor}"
+
+
+# Thumbnails are stored in a sub folder per factor, with the same file name as the full image
+def reduced_image_path(image, factor: int):
+    folder, filename = os.path.split(str(image))
+    return os.path.join(folder, reduced_dir_name(factor), filename)
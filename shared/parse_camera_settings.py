@@ -4,7 +4,11 @@ from .camera_manager import camera_settings_path
 from .interim_password_manager import get_credentials
 
 
-def parse_camera_settings(cam_stream: str):
+# Keys in cameras.toml for how captured images are stored
+storage_settings = ("codec", "quality", "thumbnails", "archive", "index")
+
+
+def _load_camera_config(cam_stream: str):
     if not os.path.isfile(camera_settings_path):
         raise FileNotFoundError(f"File {camera_settings_path} not found")
     with open(camera_settings_path, "r") as f:
@@ -20,6 +24,32 @@ def parse_camera_settings(cam_stream: str):
         raise ValueError(
             f"Camera type '{camera_type}' not found in {camera_settings_path}"
         )
+    return config, camera_type, stream_type
+
+
+# Storage settings may be given per camera, and overridden per stream
+def parse_storage_settings(cam_stream: str):
+    config, camera_type, stream_type = _load_camera_config(cam_stream)
+
+    settings = {
+        key: value
+        for key, value in config[camera_type].items()
+        if key in storage_settings
+    }
+    stream_config = config[camera_type].get(stream_type)
+    if isinstance(stream_config, dict):
+        settings.update(
+            {
+                key: value
+                for key, value in stream_config.items()
+                if key in storage_settings
+            }
+        )
+    return settings
+
+
+def parse_camera_settings(cam_stream: str):
+    config, camera_type, stream_type = _load_camera_config(cam_stream)
 
     cam_ip = config[camera_type]["ip"]
     if stream_type and stream_type in config[camera_type]:
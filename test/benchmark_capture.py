@@ -0,0 +1,117 @@
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from timelapse.capture_scheduler import CaptureScheduler
+from timelapse.image_writer import ImageWriter, WriterQueue
+from .synthetic_video_capture import Synthetic_cv2_VideoCapture, default_fps
+from .test_timelapse_capture import TestTimelapseCapture
+
+"""
+Benchmark frame generation and the capture loop with synthetic cameras.
+
+Run from repository root, e.g.
+    python -m test.benchmark_capture --cameras 24 --duration 60 --drop-rate 0.05
+"""
+
+
+def benchmark_frames(nbr_of_cameras: int, nbr_of_frames: int, resolution):
+    cams = [
+        Synthetic_cv2_VideoCapture(resolution=resolution, realtime=False, seed=i)
+        for i in range(nbr_of_cameras)
+    ]
+    t0 = time.perf_counter()
+    for _ in range(nbr_of_frames):
+        for cap in cams:
+            cap.read()
+    elapsed_s = time.perf_counter() - t0
+    fps = nbr_of_cameras * nbr_of_frames / elapsed_s
+    print(
+        f"Generated {nbr_of_cameras * nbr_of_frames} frames at {resolution[0]}x{resolution[1]}: "
+        f"{fps:.0f} frames/s, enough for {fps / default_fps:.1f} real time cameras at {default_fps} fps"
+    )
+
+
+def benchmark_capture_loop(
+    nbr_of_cameras: int,
+    duration_s: float,
+    interval_s: float,
+    resolution,
+    synthetic_args: dict,
+    background_grab: bool,
+):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cwd = os.getcwd()
+        os.chdir(tmp_dir)
+        try:
+            with WriterQueue() as writer_queue:
+                cams = [
+                    TestTimelapseCapture(
+                        test_mode="synthetic",
+                        synthetic_args={
+                            **synthetic_args,
+                            "resolution": resolution,
+                            "seed": 1000 * i,
+                        },
+                        url=None,
+                        description=f"synthetic-{i}",
+                        flush_frames=0,
+                        image_interval_s=interval_s,
+                        image_writer=ImageWriter(
+                            description=f"synthetic-{i}", queue=writer_queue
+                        ),
+                        background_grab=background_grab,
+                    )
+                    for i in range(nbr_of_cameras)
+                ]
+                scheduler = CaptureScheduler(cams=cams)
+                threading.Timer(duration_s, scheduler.stop).start()
+                cpu_t0 = time.process_time()
+                scheduler.run()
+                cpu_s = time.process_time() - cpu_t0
+        finally:
+            os.chdir(cwd)
+
+    nbr_of_captures = sum(cam.nbr_of_captures for cam in cams)
+    read_s = [cam.read_s for cam in cams if cam.read_s is not None]
+    print(
+        f"{nbr_of_cameras} cameras for {duration_s} s: {nbr_of_captures} captures, "
+        f"{sum(cam.nbr_of_read_errors for cam in cams)} read errors, "
+        f"{sum(cam.nbr_of_open_errors for cam in cams)} open errors, "
+        f"mean read latency {sum(read_s) / max(len(read_s), 1):.3f} s, "
+        f"mean encode latency {writer_queue.mean_encode_latency_s or 0:.3f} s, "
+        f"CPU time {cpu_s:.1f} s"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark capture loop with synthetic cameras"
+    )
+    parser.add_argument("--cameras", "-n", type=int, default=12)
+    parser.add_argument("--duration", "-d", type=float, default=30)
+    parser.add_argument("--interval", "-i", type=float, default=2)
+    parser.add_argument("--resolution", "-r", type=int, nargs=2, default=(1280, 720))
+    parser.add_argument("--frames", type=int, default=100)
+    parser.add_argument("--open-failure-rate", type=float, default=0)
+    parser.add_argument("--drop-rate", type=float, default=0)
+    parser.add_argument("--stall-rate", type=float, default=0)
+    parser.add_argument("--background-grab", "-g", action="store_true")
+    args = parser.parse_args()
+
+    resolution = tuple(args.resolution)
+    benchmark_frames(args.cameras, args.frames, resolution)
+    benchmark_capture_loop(
+        nbr_of_cameras=args.cameras,
+        duration_s=args.duration,
+        interval_s=args.interval,
+        resolution=resolution,
+        synthetic_args={
+            "open_failure_rate": args.open_failure_rate,
+            "drop_rate": args.drop_rate,
+            "stall_rate": args.stall_rate,
+        },
+        background_grab=args.background_grab,
+    )
@@ -0,0 +1,107 @@
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from shared.image_files import reduction_factors
+from timelapse.image_writer import ImageWriter
+from video.video_template import VideoTemplate
+from .synthetic_video_capture import Synthetic_cv2_VideoCapture
+
+"""
+Benchmark decoding for low resolution output: full decode, reduced decode and
+stored thumbnails, with the difference to full decode as a check.
+
+Run from repository root, e.g.
+    python -m test.benchmark_decode --resolution 1920 1080 --output 480 270
+"""
+
+
+def write_images(folder, codec, nbr_of_frames, resolution, thumbnails):
+    cap = Synthetic_cv2_VideoCapture(resolution=resolution, realtime=False)
+    writer = ImageWriter(description=folder, codec=codec, thumbnails=thumbnails)
+    t0 = time.time()
+    for i in range(nbr_of_frames):
+        # Frames some simulated minutes apart, so that they differ
+        for _ in range(50):
+            cap.grab()
+        success, frame = cap.retrieve()
+        writer.write(frame, timestamp=t0 + i)
+    return sorted(
+        os.path.join(folder, f)
+        for f in os.listdir(folder)
+        if os.path.isfile(os.path.join(folder, f))
+    )
+
+
+def render(images, resolution, output_resolution, use_thumbnails):
+    template = VideoTemplate(
+        images=images,
+        input_resolution=resolution,
+        input_resolution_fixed=True,
+        output_resolution=output_resolution,
+        use_thumbnails=use_thumbnails,
+        workers=1,
+    )
+    t0 = time.perf_counter()
+    frames = list(template.process_frames())
+    elapsed_s = time.perf_counter() - t0
+    return frames, 1000 * elapsed_s / len(images), template._thumbnail_factor
+
+
+def benchmark_decode(codecs, nbr_of_frames, resolution, output_resolution):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cwd = os.getcwd()
+        os.chdir(tmp_dir)
+        try:
+            for codec in codecs:
+                for thumbnails in ((), reduction_factors):
+                    folder = f"{codec}-{len(thumbnails)}"
+                    images = write_images(
+                        folder, codec, nbr_of_frames, resolution, thumbnails
+                    )
+                    reference, full_ms, _ = render(
+                        images, resolution, output_resolution, use_thumbnails=False
+                    )
+                    frames, reduced_ms, factor = render(
+                        images, resolution, output_resolution, use_thumbnails=True
+                    )
+                    difference = np.mean(
+                        [
+                            np.mean(np.abs(a.astype(int) - b.astype(int)))
+                            for a, b in zip(frames, reference)
+                        ]
+                    )
+                    source = "thumbnails" if thumbnails else "reduced decode"
+                    print(
+                        f"{codec:14s} {source:15s} factor {factor}: "
+                        f"{full_ms:.1f} -> {reduced_ms:.1f} ms/frame "
+                        f"({full_ms / reduced_ms:.1f}x), "
+                        f"mean difference {difference:.2f} intensity levels"
+                    )
+        finally:
+            os.chdir(cwd)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark reduced resolution decoding of stored images"
+    )
+    parser.add_argument("--frames", "-n", type=int, default=20)
+    parser.add_argument(
+        "--resolution", "-r", type=int, nargs=2, default=(1920, 1080)
+    )
+    parser.add_argument("--output", "-o", type=int, nargs=2, default=(480, 270))
+    parser.add_argument(
+        "--codecs", nargs="+", default=["jpg", "png", "webp", "webp-lossless"]
+    )
+    args = parser.parse_args()
+
+    benchmark_decode(
+        codecs=args.codecs,
+        nbr_of_frames=args.frames,
+        resolution=tuple(args.resolution),
+        output_resolution=tuple(args.output),
+    )
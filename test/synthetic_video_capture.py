@@ -0,0 +1,125 @@
+import cv2
+import numpy as np
+import time
+
+"""
+Deterministic synthetic camera with the interface of cv2.VideoCapture.
+
+Frames depend only on frame number and seed, and are built from precomputed
+arrays, so dozens of instances can run in one process when benchmarking.
+"""
+
+default_resolution = (640, 480)
+default_fps = 25
+# Simulated seconds per day, i.e. a full day/night cycle every 4 minutes at 25 fps
+default_day_length_s = 240
+max_noise = 12
+
+
+class Synthetic_cv2_VideoCapture:
+
+    def __init__(
+        self,
+        *args,
+        resolution: tuple[int, int] = default_resolution,
+        fps: float = default_fps,
+        day_length_s: float = default_day_length_s,
+        nbr_of_objects: int = 3,
+        open_failure_rate: float = 0,
+        drop_rate: float = 0,
+        stall_rate: float = 0,
+        stall_s: float = 5,
+        realtime: bool = True,
+        seed: int = 0,
+        **kwargs,
+    ):
+        self.width, self.height = resolution
+        self.fps = fps
+        self.day_length_s = day_length_s
+        self.drop_rate = drop_rate
+        self.stall_rate = stall_rate
+        self.stall_s = stall_s
+        self.realtime = realtime
+
+        self.frame_count = 0
+        self._rng = np.random.default_rng(seed)
+        self._next_frame_time = time.monotonic()
+        self.is_opened = self._rng.random() >= open_failure_rate
+
+        # Background gradient, computed once
+        y = np.linspace(0, 1, self.height, dtype=np.float32)[:, None]
+        x = np.linspace(0, 1, self.width, dtype=np.float32)[None, :]
+        self._background = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        self._background[:, :, 0] = (255 * y).astype(np.uint8)
+        self._background[:, :, 1] = (60 + 120 * x * (1 - y)).astype(np.uint8)
+        self._background[:, :, 2] = (255 * (1 - y)).astype(np.uint8)
+
+        # Sensor noise, cycled between frames. Stored per channel, as broadcasting
+        #   a single channel when adding is several times slower than cv2.add
+        self._noise = self._rng.integers(
+            0, max_noise, size=(4, self.height, self.width, 3), dtype=np.uint8
+        )
+
+        # Objects moving on Lissajous curves: center, amplitude, angular frequency, phase, radius, color
+        n = nbr_of_objects
+        self._centers = self._rng.uniform(0.3, 0.7, size=(n, 2)) * resolution
+        self._amplitudes = self._rng.uniform(0.1, 0.3, size=(n, 2)) * resolution
+        self._frequencies = self._rng.uniform(0.05, 0.5, size=(n, 2))
+        self._phases = self._rng.uniform(0, 2 * np.pi, size=(n, 2))
+        self._radii = self._rng.integers(10, max(11, min(resolution) // 8), size=n)
+        self._colors = self._rng.integers(0, 256, size=(n, 3))
+
+    def _brightness_lut(self, t):
+        # Night at start of day, noon at half day, with a floor for night time
+        daylight = max(0.0, -np.cos(2 * np.pi * t / self.day_length_s))
+        gain = 0.08 + 0.92 * daylight
+        # Leave headroom for noise, so that adding it cannot overflow
+        return np.clip(np.arange(256) * gain, 0, 255 - max_noise).astype(np.uint8)
+
+    def _render(self, frame_number):
+        t = frame_number / self.fps
+        frame = cv2.LUT(self._background, self._brightness_lut(t))
+        cv2.add(frame, self._noise[frame_number % len(self._noise)], dst=frame)
+
+        positions = self._centers + self._amplitudes * np.sin(
+            self._frequencies * t + self._phases
+        )
+        for (x, y), radius, color in zip(
+            positions.astype(int).tolist(), self._radii.tolist(), self._colors.tolist()
+        ):
+            cv2.circle(frame, (x, y), radius, color, -1)
+        return frame
+
+    def _wait_for_frame(self):
+        if self.realtime:
+            delay_s = self._next_frame_time - time.monotonic()
+            if delay_s > 0:
+                time.sleep(delay_s)
+            self._next_frame_time = max(self._next_frame_time, time.monotonic()) + (
+                1 / self.fps
+            )
+        if self.stall_rate and self._rng.random() < self.stall_rate:
+            time.sleep(self.stall_s)
+
+    def grab(self):
+        if not self.is_opened:
+            return False
+        self._wait_for_frame()
+        self.frame_count += 1
+        return not (self.drop_rate and self._rng.random() < self.drop_rate)
+
+    def retrieve(self):
+        if not self.is_opened or self.frame_count == 0:
+            return False, None
+        return True, self._render(self.frame_count - 1)
+
+    def read(self):
+        if not self.grab():
+            return False, None
+        return self.retrieve()
+
+    def isOpened(self):
+        return self.is_opened
+
+    def release(self):
+        self.is_opened = False
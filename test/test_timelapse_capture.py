@@ -1,12 +1,23 @@
 from timelapse.timelapse_capture import TimelapseCapture
+from .synthetic_video_capture import Synthetic_cv2_VideoCapture
 from .test_video_capture import Test_cv2_VideoCapture
 
 
 class TestTimelapseCapture(TimelapseCapture):
 
-    def __init__(self, test_mode: str = None, *args, **kwargs):
+    # synthetic_args are passed to Synthetic_cv2_VideoCapture if test_mode is "synthetic"
+    def __init__(
+        self, test_mode: str = None, *args, synthetic_args: dict = None, **kwargs
+    ):
         super().__init__(*args, **kwargs)
         self.test_mode = test_mode
+        self.synthetic_args = dict(synthetic_args or {})
+        self._nbr_of_opens = 0
 
     def _create_capture(self):
+        if self.test_mode == "synthetic":
+            # New seed for each reconnect, so that injected failures differ between connections
+            seed = self.synthetic_args.get("seed", 0) + self._nbr_of_opens
+            self._nbr_of_opens += 1
+            return Synthetic_cv2_VideoCapture(**{**self.synthetic_args, "seed": seed})
         return Test_cv2_VideoCapture(test_mode=self.test_mode)
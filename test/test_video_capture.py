@@ -1,11 +1,17 @@
 import cv2
 import numpy as np
+import os
 import time
+from pathlib import Path
 
 """
 Override cv2.VideoCapture
 """
 
+humanoids_url = "https://images.unsplash.com/photo-1511632765486-a01980e01a18?w=640&h=480&fit=crop"
+# Downloaded image is kept, so that humanoids mode also works offline after first run
+humanoids_cache_path = Path(os.path.expanduser("~")) / "cache" / "test_humans.jpg"
+
 
 class Test_cv2_VideoCapture:
 
@@ -14,56 +20,63 @@ class Test_cv2_VideoCapture:
         self.frame_count = 0
         self.is_opened = True
 
+        height, width = 480, 640
+        # Gradient background, computed once
+        rows = np.arange(height, dtype=np.int32)[:, None]
+        self.gradient = np.zeros((height, width, 3), dtype=np.uint8)
+        self.gradient[:, :, 0] = rows * 255 // height
+        self.gradient[:, :, 1] = 100
+        self.gradient[:, :, 2] = (height - rows) * 255 // height
+
         if test_mode == "humanoids":
+            img = self._load_humanoids()
+            if img is None:
+                # Offline and nothing cached, fall back to gradient
+                print("No image with humans available, using gradient")
+                self.test_mode = "gradient"
+            else:
+                # Resize to match our frame size
+                self.frame = cv2.resize(img, (width, height))
+
+    def _load_humanoids(self):
+        if not humanoids_cache_path.is_file():
             import requests
-            import os
 
-            image_url = "https://images.unsplash.com/photo-1511632765486-a01980e01a18?w=640&h=480&fit=crop"
             try:
                 response = requests.get(
-                    image_url,
+                    humanoids_url,
                     timeout=15,
                     headers={
                         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
                     },
                 )
                 if response.status_code == 200:
-                    temp_path = "temp_humans.jpg"
-                    with open(temp_path, "wb") as f:
+                    os.makedirs(humanoids_cache_path.parent, exist_ok=True)
+                    with open(humanoids_cache_path, "wb") as f:
                         f.write(response.content)
-
-                    img = cv2.imread(temp_path)
-                    if img is not None:
-                        # Resize to match our frame size
-                        img = cv2.resize(img, (640, 480))
-                        self.frame = img
-
-                        os.remove(temp_path)
-
-                    if os.path.exists(temp_path):
-                        os.remove(temp_path)
-
             except Exception as e:
-                print(f"Failed to download image {image_url}: {e}")
+                print(f"Failed to download image {humanoids_url}: {e}")
+                return None
+        return cv2.imread(str(humanoids_cache_path))
 
     def grab(self):
         if not self.is_opened:
             return False
-        return False
+        # Pace like a live stream
+        time.sleep(0.04)
+        return True
+
+    def retrieve(self):
+        return self.read()
 
     def read(self):
         if not self.is_opened:
             return False, None
 
-        height, width = 480, 640
-        frame = np.zeros((height, width, 3), dtype=np.uint8)
-
         if self.test_mode == "gradient":
-            # Add gradient background
-            for i in range(height):
-                frame[i, :] = [i * 255 // height, 100, (height - i) * 255 // height]
+            frame = self.gradient.copy()
         elif self.test_mode == "humanoids":
-            frame = self.frame
+            frame = self.frame.copy()
         else:
             raise Exception(f"Illegal test mode option: {self.test_mode}")
 
@@ -1,5 +1,18 @@
 import argparse
+from timelapse.burst_recorder import default_burst_fps
+from timelapse.image_writer import WriterQueue, default_writer_workers
+from timelapse.reconnect import (
+    default_base_delay_s,
+    default_immediate_retries,
+    default_max_delay_s,
+    default_probe_timeout_s,
+)
 from timelapse.record_timelapse import create_network_camera, record_timelapse
+from timelapse.retention import (
+    default_daily_time,
+    default_full_rate_days,
+    default_hourly_days,
+)
 
 default_flush_frames = 0
 default_image_interval_s = 600
@@ -15,7 +28,15 @@ if __name__ == "__main__":
         type=str,
         help='Location (e.g. "garden") or portrayed object (e.g. "sprouting plant")',
     )
-    parser.add_argument("--test", "-t", action="store_true", default=False)
+    parser.add_argument(
+        "--test",
+        "-t",
+        nargs="?",
+        const="humanoids",
+        default=None,
+        choices=["humanoids", "gradient", "synthetic"],
+        help="Use mockup camera. Default mode: humanoids",
+    )
     parser.add_argument(
         "--snapshot",
         "-s",
@@ -43,17 +64,148 @@ if __name__ == "__main__":
         default=default_flush_frames,
         help=f"Number of frames to flush. Default: {default_flush_frames}",
     )
+    parser.add_argument(
+        "--async-write",
+        "-a",
+        type=int,
+        nargs="?",
+        const=default_writer_workers,
+        default=None,
+        metavar="WORKERS",
+        help=f"Encode and write images in background threads. Default number of threads: {default_writer_workers}",
+    )
+    parser.add_argument(
+        "--background-grab",
+        "-g",
+        action="store_true",
+        default=False,
+        help="Drain the open stream in a background thread, replacing --flush. Ignored with --restart-every-cycle",
+    )
+    parser.add_argument(
+        "--align",
+        action="store_true",
+        default=False,
+        help="Capture on wall clock multiples of --interval, e.g. at :00, :10, :20 for 600 seconds",
+    )
+    parser.add_argument(
+        "--dedup",
+        type=float,
+        default=None,
+        metavar="THRESHOLD",
+        help="Skip frames whose mean intensity difference (0-255) to the last stored frame is below threshold, e.g. 2",
+    )
+
+    parser.add_argument(
+        "--burst",
+        type=float,
+        nargs=2,
+        default=None,
+        metavar=("PRE_S", "POST_S"),
+        help="Keep recent low resolution frames in memory, and store seconds before and after a trigger (kill -USR1 or --motion). Ignored with --restart-every-cycle",
+    )
+    parser.add_argument(
+        "--burst-fps",
+        type=float,
+        default=default_burst_fps,
+        help=f"Frames per second in bursts. Default: {default_burst_fps}",
+    )
+    parser.add_argument(
+        "--motion",
+        type=float,
+        default=None,
+        metavar="FRACTION",
+        help="Trigger burst when this fraction of the image changes between frames, e.g. 0.01",
+    )
+    parser.add_argument(
+        "--retain-gb",
+        type=float,
+        default=None,
+        help="Delete oldest images and bursts when the image folder exceeds this size in GB",
+    )
+    parser.add_argument(
+        "--min-free-gb",
+        type=float,
+        default=None,
+        help="Delete oldest images when free disk space falls below this size in GB",
+    )
+    parser.add_argument(
+        "--thin",
+        type=float,
+        nargs=2,
+        default=None,
+        metavar=("FULL_DAYS", "HOURLY_DAYS"),
+        help=f"Keep all images for FULL_DAYS, then one per hour until HOURLY_DAYS, then one per day, e.g. {default_full_rate_days} {default_hourly_days}",
+    )
+    parser.add_argument(
+        "--daily-time",
+        default=default_daily_time,
+        help=f"Time of day (HH:MM) of images kept by --thin after HOURLY_DAYS. Default: {default_daily_time}",
+    )
+    parser.add_argument(
+        "--immediate-retries",
+        type=int,
+        default=default_immediate_retries,
+        help=f"Number of failures after which the stream is reopened without waiting. Default: {default_immediate_retries}",
+    )
+    parser.add_argument(
+        "--backoff",
+        type=float,
+        nargs=2,
+        default=(default_base_delay_s, default_max_delay_s),
+        metavar=("BASE_S", "MAX_S"),
+        help=f"Wait before reconnecting after further failures, doubling from BASE_S up to MAX_S. Default: {default_base_delay_s} {default_max_delay_s}",
+    )
+    parser.add_argument(
+        "--probe-timeout",
+        type=float,
+        default=default_probe_timeout_s,
+        help=f"Timeout in seconds of TCP check that the camera is reachable before opening stream, 0 disables check. Default: {default_probe_timeout_s}",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=None,
+        help="Serve capture metrics in Prometheus format on this port",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        default=None,
+        help="Write capture metrics in Prometheus format to this file, e.g. for the node_exporter textfile collector",
+    )
 
     args = parser.parse_args()
 
+    writer_queue = None
+    if args.async_write:
+        writer_queue = WriterQueue(workers=args.async_write)
+
     cam = create_network_camera(
         cam_stream=args.cam,
         description=args.descr,
         flush_frames=args.flush,
         image_interval_s=args.interval,
-        test=args.test,
+        test=args.test is not None,
+        test_mode=args.test,
+        writer_queue=writer_queue,
+        background_grab=args.background_grab and not args.restart_every_cycle,
+        align_to_clock=args.align,
+        dedup_threshold=args.dedup,
+        burst_s=None if args.restart_every_cycle else args.burst,
+        burst_fps=args.burst_fps,
+        motion_threshold=args.motion,
+        retain_gb=args.retain_gb,
+        min_free_gb=args.min_free_gb,
+        thin_days=args.thin,
+        daily_time=args.daily_time,
+        immediate_retries=args.immediate_retries,
+        backoff_s=args.backoff,
+        probe_timeout_s=args.probe_timeout,
     )
 
     record_timelapse(
-        cam=cam, persistent=not args.restart_every_cycle, snapshot=args.snapshot
+        cam=cam,
+        persistent=not args.restart_every_cycle,
+        snapshot=args.snapshot,
+        metrics_port=args.metrics_port,
+        metrics_file=args.metrics_file,
     )
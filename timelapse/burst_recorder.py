@@ -0,0 +1,148 @@
+import cv2
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from shared.image_files import bursts_dir
+from .duplicate_filter import frame_signature
+from .image_writer import WriterQueue, default_queue_size
+from .retention import RetentionManager
+
+logger = logging.getLogger(__name__)
+
+default_burst_fps = 2
+default_burst_width = 640
+# Grid used for motion detection, and intensity change (0-255) counted as motion in a cell
+motion_signature_size = 64
+motion_intensity_threshold = 25
+
+
+class BurstRecorder:
+    """
+    Keep recent low resolution frames in memory and store them around events.
+
+    Frames are fed from the grabber thread of a persistent stream at burst_fps.
+    When triggered, either externally or by motion, the ring buffer holding the
+    last pre_s seconds is written to a new burst folder, followed by all frames
+    until post_s seconds after the last trigger. This catches short events
+    without lowering the timelapse interval.
+
+    Attributes:
+        description: Image folder, bursts are written to <description>/bursts/
+        pre_s: Seconds of frames kept before a trigger
+        post_s: Seconds of frames recorded after a trigger
+        burst_fps: Frames per second kept in buffer and recorded
+        burst_width: Width of stored frames, height keeps aspect ratio
+        motion_threshold: Trigger when this fraction of the image changes
+            between consecutive frames, e.g. 0.01. None disables motion trigger
+        extension: File extension of stored frames
+        params: OpenCV encoding parameters of stored frames
+        retention: Optional retention of the image folder, which counts bursts
+            in its budget
+    """
+
+    def __init__(
+        self,
+        description: str,
+        pre_s: float,
+        post_s: float,
+        burst_fps: float = default_burst_fps,
+        burst_width: int = default_burst_width,
+        motion_threshold: float = None,
+        extension: str = ".jpg",
+        params: list = None,
+        retention: RetentionManager = None,
+    ):
+        self.description = description
+        self.pre_s = pre_s
+        self.post_s = post_s
+        self.burst_fps = burst_fps
+        self.burst_width = burst_width
+        self.motion_threshold = motion_threshold
+        self.extension = extension
+        self.params = params or []
+        self.retention = retention
+
+        self.nbr_of_bursts = 0
+        self._buffer = deque(maxlen=max(int(pre_s * burst_fps), 1))
+        # Reentrant, as trigger() may be called from a signal handler
+        self._lock = threading.RLock()
+        self._previous_signature = None
+        self._burst_folder = None
+        self._burst_end = 0
+        self._queue = WriterQueue(
+            maxsize=self._buffer.maxlen + default_queue_size, workers=1
+        )
+
+    def close(self):
+        self._queue.close()
+
+    # Record a burst now. Safe to call from any thread, e.g. a signal handler
+    def trigger(self, reason: str = "external trigger"):
+        with self._lock:
+            now = time.time()
+            if self._burst_folder is None:
+                self._start_burst(now, reason)
+            self._burst_end = now + self.post_s
+
+    # Called from grabber thread with every sampled frame
+    def feed(self, frame, timestamp: float):
+        height, width = frame.shape[:2]
+        if width > self.burst_width:
+            size = (self.burst_width, round(height * self.burst_width / width))
+            frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+
+        if self.motion_threshold is not None and self._detect_motion(frame):
+            self.trigger(reason="motion")
+
+        with self._lock:
+            if self._burst_folder is not None:
+                self._store(frame, timestamp)
+                if timestamp > self._burst_end:
+                    logger.info(f"Burst finished in {self._burst_folder}")
+                    self._burst_folder = None
+            else:
+                self._buffer.append((timestamp, frame))
+
+    def _detect_motion(self, frame):
+        signature = frame_signature(frame, motion_signature_size)
+        previous, self._previous_signature = self._previous_signature, signature
+        if previous is None:
+            return False
+        changed = np.mean(np.abs(signature - previous) > motion_intensity_threshold)
+        return changed > self.motion_threshold
+
+    def _start_burst(self, now, reason):
+        date_str = time.strftime("%Y-%m-%d-%H-%M-%S", time.localtime(now))
+        self._burst_folder = os.path.join(
+            self.description, bursts_dir, f"{self.description}-{date_str}"
+        )
+        os.makedirs(self._burst_folder, exist_ok=True)
+        self.nbr_of_bursts += 1
+        logger.info(
+            f"Recording burst ({reason}), {len(self._buffer)} buffered frames, in {self._burst_folder}"
+        )
+        while self._buffer:
+            timestamp, frame = self._buffer.popleft()
+            self._store(frame, timestamp)
+
+    # Filenames include milliseconds, as there are several frames per second
+    def _store(self, frame, timestamp):
+        date_str = time.strftime("%Y-%m-%d-%H-%M-%S", time.localtime(timestamp))
+        ms = int((timestamp % 1) * 1000)
+        filename = os.path.join(
+            self._burst_folder,
+            f"{self.description}-{date_str}-{ms:03d}{self.extension}",
+        )
+        self._queue.put(self._write, filename, frame)
+
+    # Called in writer thread
+    def _write(self, filename, frame):
+        success = cv2.imwrite(filename, frame, self.params)
+        if success and self.retention is not None:
+            self.retention.add_burst_frame(filename)
+        return success
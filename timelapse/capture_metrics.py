@@ -0,0 +1,234 @@
+import logging
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .image_writer import WriterQueue
+from .timelapse_capture import TimelapseCapture
+
+logger = logging.getLogger(__name__)
+
+default_textfile_interval_s = 15
+
+# Name, type, help text and getter of metrics reported per camera
+camera_metrics = [
+    (
+        "timelapse_stream_open_seconds",
+        "gauge",
+        "Time to open the camera stream on last attempt",
+        lambda cam: cam.stream_open_s,
+    ),
+    (
+        "timelapse_read_seconds",
+        "gauge",
+        "Time to grab and decode a frame on last capture",
+        lambda cam: cam.read_s,
+    ),
+    (
+        "timelapse_write_seconds",
+        "gauge",
+        "Time to encode and write last image, including thumbnails",
+        lambda cam: cam.image_writer.last_write_s,
+    ),
+    (
+        "timelapse_consecutive_failures",
+        "gauge",
+        "Number of consecutive failed captures",
+        lambda cam: cam.nbr_of_failed_captures,
+    ),
+    (
+        "timelapse_backoff_seconds",
+        "gauge",
+        "Current extra wait before reconnecting after failures",
+        lambda cam: cam.delay_start_s,
+    ),
+    (
+        "timelapse_last_capture_timestamp_seconds",
+        "gauge",
+        "Unix time of last successful capture",
+        lambda cam: cam.last_capture_time,
+    ),
+    (
+        "timelapse_captures_total",
+        "counter",
+        "Number of successful captures",
+        lambda cam: cam.nbr_of_captures,
+    ),
+    (
+        "timelapse_read_errors_total",
+        "counter",
+        "Number of failed frame reads",
+        lambda cam: cam.nbr_of_read_errors,
+    ),
+    (
+        "timelapse_open_errors_total",
+        "counter",
+        "Number of failed attempts to open the stream",
+        lambda cam: cam.nbr_of_open_errors,
+    ),
+    (
+        "timelapse_missed_slots_total",
+        "counter",
+        "Number of wall clock aligned capture slots without a capture",
+        lambda cam: cam.nbr_of_missed_slots,
+    ),
+    (
+        "timelapse_bursts_total",
+        "counter",
+        "Number of recorded bursts",
+        lambda cam: (
+            cam.burst_recorder.nbr_of_bursts if cam.burst_recorder is not None else 0
+        ),
+    ),
+    (
+        "timelapse_skipped_duplicates_total",
+        "counter",
+        "Number of frames not stored as near-duplicates",
+        lambda cam: (
+            cam.duplicate_filter.nbr_of_skipped_frames
+            if cam.duplicate_filter is not None
+            else 0
+        ),
+    ),
+]
+
+# Name, type, help text and getter of metrics reported for the shared writer queue
+writer_metrics = [
+    (
+        "timelapse_writer_queue_depth",
+        "gauge",
+        "Number of images waiting to be written",
+        lambda queue: queue.queue_depth,
+    ),
+    (
+        "timelapse_writer_encode_seconds_max",
+        "gauge",
+        "Longest time to encode and write an image",
+        lambda queue: queue.max_encode_latency_s,
+    ),
+    (
+        "timelapse_writer_encode_seconds_mean",
+        "gauge",
+        "Mean time to encode and write an image",
+        lambda queue: queue.mean_encode_latency_s,
+    ),
+    (
+        "timelapse_writer_images_total",
+        "counter",
+        "Number of images written by the queue",
+        lambda queue: queue.nbr_of_written_images,
+    ),
+]
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_metrics(cams: list[TimelapseCapture], writer_queue: WriterQueue = None):
+    """Return metrics in Prometheus text exposition format"""
+    lines = []
+    for name, metric_type, help_text, getter in camera_metrics:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for cam in cams:
+            value = getter(cam)
+            # Metrics without a value yet are left out rather than reported as zero
+            if value is not None:
+                label = _escape_label(cam.description)
+                lines.append(f'{name}{{camera="{label}"}} {float(value)}')
+
+    if writer_queue is not None:
+        for name, metric_type, help_text, getter in writer_metrics:
+            value = getter(writer_queue)
+            if value is not None:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                lines.append(f"{name} {float(value)}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsExporter:
+    """
+    Expose capture metrics over HTTP and/or as a textfile for node_exporter.
+
+    Attributes:
+        cams: Cameras to report
+        writer_queue: Optional shared writer queue to report
+        port: Serve metrics on http://<host>:<port>/metrics if given
+        textfile: Rewrite this file periodically if given, for the node_exporter textfile collector
+        textfile_interval_s: Seconds between textfile updates
+    """
+
+    def __init__(
+        self,
+        cams: list[TimelapseCapture],
+        writer_queue: WriterQueue = None,
+        port: int = None,
+        textfile: str = None,
+        textfile_interval_s: float = default_textfile_interval_s,
+    ):
+        self.cams = cams
+        self.writer_queue = writer_queue
+        self.port = port
+        self.textfile = textfile
+        self.textfile_interval_s = textfile_interval_s
+
+        self._server = None
+        self._stop = threading.Event()
+
+    def render(self):
+        return render_metrics(self.cams, self.writer_queue)
+
+    def start(self):
+        if self.port is not None:
+            exporter = self
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path not in ("/", "/metrics"):
+                        self.send_error(404)
+                        return
+                    body = exporter.render().encode()
+                    self.send_response(200)
+                    self.send_header(
+                        "Content-Type", "text/plain; version=0.0.4; charset=utf-8"
+                    )
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    logger.debug(format % args)
+
+            self._server = ThreadingHTTPServer(("", self.port), Handler)
+            threading.Thread(
+                target=self._server.serve_forever, name="metrics-http", daemon=True
+            ).start()
+            logger.info(f"Serving metrics on port {self.port}")
+
+        if self.textfile is not None:
+            threading.Thread(
+                target=self._textfile_loop, name="metrics-textfile", daemon=True
+            ).start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def _textfile_loop(self):
+        while not self._stop.wait(self.textfile_interval_s):
+            self.write_textfile()
+
+    # Replace file atomically, so the collector never reads a partial file
+    def write_textfile(self):
+        tmp_path = f"{self.textfile}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                f.write(self.render())
+            os.replace(tmp_path, self.textfile)
+        except Exception as exc:
+            logger.exception(f"Could not write metrics to {self.textfile}")
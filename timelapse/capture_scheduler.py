@@ -0,0 +1,117 @@
+import heapq
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import toml
+
+from .timelapse_capture import TimelapseCapture
+
+logger = logging.getLogger(__name__)
+
+schedule_settings_path = (
+    Path(os.path.expanduser("~")) / "settings" / "timelapse-schedule.toml"
+)
+
+default_capture_workers = 4
+
+
+class CaptureScheduler:
+    """
+    Drive several TimelapseCapture instances from a single process.
+
+    Each camera keeps its own interval and backoff state. The scheduler keeps a
+    queue of deadlines and runs due capture steps on a small thread pool, so a
+    camera waiting for a slow stream does not delay the others.
+
+    Attributes:
+        cams: Cameras to capture from
+        persistent: If True, keep streams open between captures
+        capture_workers: Number of cameras that may capture at the same time
+    """
+
+    def __init__(
+        self,
+        cams: list[TimelapseCapture],
+        persistent: bool = True,
+        capture_workers: int = None,
+    ):
+        self.cams = cams
+        self.persistent = persistent
+        self.capture_workers = capture_workers or min(
+            len(cams), default_capture_workers
+        )
+
+        self._deadlines = []
+        self._condition = threading.Condition()
+        self._stop = threading.Event()
+
+    def stop(self):
+        self._stop.set()
+        with self._condition:
+            self._condition.notify_all()
+
+    def run(self):
+        with self._condition:
+            now = time.monotonic()
+            self._deadlines = [(now, i) for i in range(len(self.cams))]
+            heapq.heapify(self._deadlines)
+
+        try:
+            with ThreadPoolExecutor(
+                max_workers=self.capture_workers, thread_name_prefix="capture"
+            ) as executor:
+                while not self._stop.is_set():
+                    index = self._next_due()
+                    if index is not None:
+                        executor.submit(self._step, index)
+        finally:
+            self._stop.set()
+            for cam in self.cams:
+                cam._release_capture()
+
+    # Block until the earliest deadline has passed and return its camera index
+    def _next_due(self):
+        with self._condition:
+            while not self._stop.is_set():
+                if self._deadlines:
+                    deadline, index = self._deadlines[0]
+                    wait_s = deadline - time.monotonic()
+                    if wait_s <= 0:
+                        heapq.heappop(self._deadlines)
+                        return index
+                else:
+                    wait_s = None
+                self._condition.wait(timeout=wait_s)
+        return None
+
+    def _step(self, index):
+        cam = self.cams[index]
+        try:
+            delay_s = cam.capture_step(persistent=self.persistent)
+        except Exception as exc:
+            logger.exception(f"Unhandled exception in capture step ({cam.description})")
+            delay_s = cam.image_interval_s
+        with self._condition:
+            heapq.heappush(self._deadlines, (time.monotonic() + delay_s, index))
+            self._condition.notify()
+
+
+# Read capture jobs, one table per output folder. Example:
+#   [sunflowers-highres]
+#   cam = "tapo.highres"
+#   interval = 600
+#   flush = 100
+def load_schedule(schedule_file=schedule_settings_path):
+    if not os.path.isfile(schedule_file):
+        raise FileNotFoundError(f"File {schedule_file} not found")
+    with open(schedule_file, "r") as f:
+        schedule = toml.load(f)
+
+    for description, job in schedule.items():
+        if "cam" not in job:
+            raise ValueError(f"No camera given for capture job '{description}'")
+    return schedule
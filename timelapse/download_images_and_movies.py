@@ -3,11 +3,28 @@ import argparse
 import os
 from pathlib import Path
 from interim_password_manager import get_ssh_login
-from download_remote_files import download_remote_files, clear_remote_images
+from download_remote_files import (
+    download_remote_files,
+    clear_remote_images,
+    clear_remote_files_except,
+    clear_remote_folders_older_than,
+)
 from video.make_video import make_video
+from shared.frame_archive import archive_extension, archive_name
+from shared.frame_index import FrameIndex
+from shared.image_files import (
+    bursts_dir,
+    image_extensions,
+    reduced_dir_name,
+    reduction_factors,
+)
+from timelapse.duplicate_filter import skipped_frames_log
 
+# Bursts not written to for this long have finished, and are deleted after download
+finished_burst_minutes = 10
 
-def main(tags, make_movie, delete_remote):
+
+def main(tags, make_movie, delete_remote, incremental=False):
     # tags = ["tradgard-torpet", "garden-lowres"]#"sunflowers-lowres", "scaffolding"]
     top_dir = Path(os.path.expanduser("~"))
     active_dir = top_dir / "repos/timelapse"
@@ -17,37 +34,110 @@ def main(tags, make_movie, delete_remote):
 
     for image_folder in tags:
 
-        # download images from active directory
+        for extension in image_extensions:
+            # download images from active directory
+            download_remote_files(
+                image_folder=image_folder,
+                filter=f"*{extension}",
+                ignore_existing=True,
+                local_top_dir=data_dir,
+                remote_top_dir=active_dir,
+                remote_login=remote_login,
+            )
+
+            # download images from data directory
+            download_remote_files(
+                image_folder=image_folder,
+                filter=f"*{extension}",
+                ignore_existing=True,
+                local_top_dir=data_dir,
+                remote_top_dir=data_dir,
+                remote_login=remote_login,
+            )
+
+            if delete_remote:
+                clear_remote_images(
+                    image_folder=image_folder,
+                    remote_top_dir=active_dir,
+                    remote_login=remote_login,
+                    filter=f"*{extension}",
+                )
+                clear_remote_images(
+                    image_folder=image_folder,
+                    remote_top_dir=data_dir,
+                    remote_login=remote_login,
+                    filter=f"*{extension}",
+                )
+
+        # download thumbnails, if any
+        for factor in reduction_factors:
+            download_remote_files(
+                image_folder=f"{image_folder}/{reduced_dir_name(factor)}",
+                filter="*",
+                ignore_existing=True,
+                local_top_dir=data_dir,
+                remote_top_dir=active_dir,
+                remote_login=remote_login,
+            )
+            if delete_remote:
+                clear_remote_images(
+                    image_folder=f"{image_folder}/{reduced_dir_name(factor)}",
+                    remote_top_dir=active_dir,
+                    remote_login=remote_login,
+                    filter="*",
+                )
+
+        # download bursts, one folder each. A burst still being recorded is completed
+        #   on the next download, as existing files are updated
         download_remote_files(
-            image_folder=image_folder,
-            filter="*.png",
-            ignore_existing=True,
+            image_folder=f"{image_folder}/{bursts_dir}",
+            filter="*",
+            ignore_existing=False,
             local_top_dir=data_dir,
             remote_top_dir=active_dir,
             remote_login=remote_login,
         )
+        if delete_remote:
+            clear_remote_folders_older_than(
+                image_folder=f"{image_folder}/{bursts_dir}",
+                remote_top_dir=active_dir,
+                remote_login=remote_login,
+                minutes=finished_burst_minutes,
+            )
 
-        # download images from data directory
+        # download per-day archives with their index. Archives grow during the day,
+        #   so existing files are updated, and the archive of today is never deleted
         download_remote_files(
             image_folder=image_folder,
-            filter="*.png",
-            ignore_existing=True,
+            filter=f"*{archive_extension}*",
+            ignore_existing=False,
             local_top_dir=data_dir,
-            remote_top_dir=data_dir,
+            remote_top_dir=active_dir,
             remote_login=remote_login,
         )
-
         if delete_remote:
-            clear_remote_images(
+            clear_remote_files_except(
                 image_folder=image_folder,
                 remote_top_dir=active_dir,
                 remote_login=remote_login,
+                filter=f"*{archive_extension}*",
+                keep=f"{archive_name(image_folder)}*",
             )
-            clear_remote_images(
-                image_folder=image_folder,
-                remote_top_dir=data_dir,
-                remote_login=remote_login,
-            )
+
+        # download log of frames skipped as near-duplicates, which grows over time
+        download_remote_files(
+            image_folder=image_folder,
+            filter=skipped_frames_log,
+            ignore_existing=False,
+            local_top_dir=data_dir,
+            remote_top_dir=active_dir,
+            remote_login=remote_login,
+        )
+
+        # add downloaded frames to the index of the local folder, so renders need not list it
+        with FrameIndex(data_dir / image_folder) as index:
+            index.refresh()
+            print(f"{len(index)} frames in {data_dir / image_folder}")
 
         # # download movies from remote active directory, and overwrite corresponding file in local data directory
         # download_remote_files(image_folder=image_folder, filter="*.mp4", ignore_existing=False,
@@ -57,7 +147,7 @@ def main(tags, make_movie, delete_remote):
 
     if make_movie:
         for tag in tags:
-            make_video(tag, tag + ".mp4", preview=True)
+            make_video(tag, tag + ".mp4", preview=True, incremental=incremental)
 
 
 if __name__ == "__main__":
@@ -77,6 +167,18 @@ if __name__ == "__main__":
         help="Delete images on remote device after downloading them",
     )
 
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        default=False,
+        help="Append only new images to existing movies, requires ffmpeg (default: False)",
+    )
+
     args = parser.parse_args()
 
-    main(tags=args.remote, make_movie=args.make_movie, delete_remote=args.delete_remote)
+    main(
+        tags=args.remote,
+        make_movie=args.make_movie,
+        delete_remote=args.delete_remote,
+        incremental=args.incremental,
+    )
@@ -4,15 +4,33 @@ from pathlib import Path
 import subprocess
 
 
-def clear_remote_images(image_folder, remote_top_dir, remote_login):
+def clear_remote_images(image_folder, remote_top_dir, remote_login, filter="*.png"):
 
     remote_dir = remote_top_dir / image_folder
-    remote_pattern = str(remote_dir / "*.png")
+    remote_pattern = str(remote_dir / filter)
 
     ssh_rm_png = f"ssh {remote_login} 'rm -f {remote_pattern}'"
     subprocess.run(ssh_rm_png, shell=True)
 
 
+# Delete files matching filter except those matching keep, e.g. an archive still being written
+def clear_remote_files_except(image_folder, remote_top_dir, remote_login, filter, keep):
+
+    remote_dir = remote_top_dir / image_folder
+
+    ssh_find_rm = f"ssh {remote_login} 'find {remote_dir} -maxdepth 1 -name \"{filter}\" ! -name \"{keep}\" -delete'"
+    subprocess.run(ssh_find_rm, shell=True)
+
+
+# Delete sub folders not modified for minutes, e.g. bursts that have finished recording
+def clear_remote_folders_older_than(image_folder, remote_top_dir, remote_login, minutes):
+
+    remote_dir = remote_top_dir / image_folder
+
+    ssh_find_rm = f"ssh {remote_login} 'find {remote_dir} -mindepth 1 -maxdepth 1 -type d -mmin +{minutes} -exec rm -rf {{}} +'"
+    subprocess.run(ssh_find_rm, shell=True)
+
+
 def download_remote_files(
     image_folder, filter, ignore_existing, local_top_dir, remote_top_dir, remote_login
 ):
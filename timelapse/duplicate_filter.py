@@ -0,0 +1,85 @@
+import cv2
+import logging
+import numpy as np
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Log of frames deliberately not stored, written to the image folder
+skipped_frames_log = "skipped-frames.csv"
+# Side of the downsampled grayscale image used for comparison
+default_signature_size = 32
+# Always store at least one frame this often, even if the scene is static
+default_max_skip_s = 3600
+
+
+# Small grayscale version of frame, used to compare frames cheaply
+def frame_signature(frame, size: int = default_signature_size):
+    if frame.ndim == 3:
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    signature = cv2.resize(frame, (size, size), interpolation=cv2.INTER_AREA)
+    return signature.astype(np.float32)
+
+
+class DuplicateFilter:
+    """
+    Detect frames that are nearly identical to the last stored frame.
+
+    Frames are compared as small grayscale images, using the mean absolute
+    difference in pixel intensity (0 - 255). Downsampling averages out sensor
+    noise, so dark night frames are compared by content rather than noise.
+    Skipped frames are appended to a log in the image folder, so downstream
+    tools can tell deliberate gaps from capture failures.
+
+    Attributes:
+        description: Image folder
+        threshold: Frames with mean difference below threshold are duplicates
+        max_skip_s: Longest time between stored frames
+        signature_size: Side of downsampled image used for comparison
+    """
+
+    def __init__(
+        self,
+        description: str,
+        threshold: float,
+        max_skip_s: float = default_max_skip_s,
+        signature_size: int = default_signature_size,
+    ):
+        self.description = description
+        self.threshold = threshold
+        self.max_skip_s = max_skip_s
+        self.signature_size = signature_size
+        self.log_path = os.path.join(description, skipped_frames_log)
+
+        self.nbr_of_skipped_frames = 0
+        self._reference = None
+        self._reference_time = None
+
+    # Returns True if frame should be skipped. Otherwise frame becomes new reference
+    def is_duplicate(self, frame, timestamp: float = None):
+        timestamp = timestamp or time.time()
+        signature = frame_signature(frame, self.signature_size)
+
+        if (
+            self._reference is not None
+            and timestamp - self._reference_time < self.max_skip_s
+        ):
+            difference = float(np.mean(np.abs(signature - self._reference)))
+            if difference < self.threshold:
+                self._log_skipped(timestamp, difference)
+                return True
+
+        self._reference = signature
+        self._reference_time = timestamp
+        return False
+
+    def _log_skipped(self, timestamp, difference):
+        self.nbr_of_skipped_frames += 1
+        write_header = not os.path.isfile(self.log_path)
+        with open(self.log_path, "a") as f:
+            if write_header:
+                f.write("timestamp,difference\n")
+            date_str = time.strftime("%Y-%m-%d-%H-%M-%S", time.localtime(timestamp))
+            f.write(f"{date_str},{difference:.2f}\n")
+        logger.info(f"Skipped near-duplicate image (difference {difference:.2f})")
@@ -0,0 +1,123 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Longest time to wait for a frame from the grabber thread
+default_read_timeout_s = 10
+# Pause after a failed grab, to avoid spinning on a broken stream
+grab_retry_delay_s = 0.1
+
+
+class FrameGrabber:
+    """
+    Keep draining an open capture stream in a background thread.
+
+    The thread calls grab() continuously, so that the RTSP buffer never holds
+    stale frames. When read() is called, the next grabbed frame is decoded and
+    handed over, which replaces sleeping and flushing before every capture.
+    Only the grabber thread touches the capture object, as cv2.VideoCapture is
+    not thread safe.
+
+    Attributes:
+        cap: Opened capture stream
+        read_timeout_s: Longest time read() waits for a frame
+        on_frame: Optional callback on_frame(frame, timestamp), called from the
+            grabber thread with a decoded frame every on_frame_interval_s
+        on_frame_interval_s: Seconds between frames passed to on_frame
+    """
+
+    def __init__(
+        self,
+        cap,
+        read_timeout_s: float = default_read_timeout_s,
+        on_frame=None,
+        on_frame_interval_s: float = None,
+    ):
+        self.cap = cap
+        self.read_timeout_s = read_timeout_s
+        self.on_frame = on_frame
+        self.on_frame_interval_s = on_frame_interval_s or 0
+        self._last_on_frame_time = 0
+
+        self.nbr_of_failed_grabs = 0
+        self.last_grab_time = None
+
+        self._stop = threading.Event()
+        self._requested = threading.Event()
+        self._done = threading.Event()
+        self._read_lock = threading.Lock()
+        self._result = (False, None)
+        self._thread = threading.Thread(
+            target=self._grab_loop, name="grabber", daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout=self.read_timeout_s)
+            if self._thread.is_alive():
+                logger.error("Grabber thread did not stop")
+
+    # Return the newest frame from the stream, with the same signature as cv2.VideoCapture.read
+    def read(self):
+        if not self._thread.is_alive():
+            return False, None
+        with self._read_lock:
+            self._done.clear()
+            self._requested.set()
+            if not self._done.wait(timeout=self.read_timeout_s):
+                self._requested.clear()
+                logger.error(f"No frame grabbed within {self.read_timeout_s} seconds")
+                return False, None
+            return self._result
+
+    def _grab_loop(self):
+        while not self._stop.is_set():
+            try:
+                success = self.cap.grab()
+            except Exception as exc:
+                logger.exception("Exception grabbing frame")
+                success = False
+
+            if success:
+                self.nbr_of_failed_grabs = 0
+                self.last_grab_time = time.time()
+            else:
+                self.nbr_of_failed_grabs += 1
+                logger.debug(f"Grabbing error {self.nbr_of_failed_grabs}")
+
+            requested = self._requested.is_set()
+            sample = (
+                success
+                and self.on_frame is not None
+                and self.last_grab_time - self._last_on_frame_time
+                >= self.on_frame_interval_s
+            )
+
+            result = (False, None)
+            if success and (requested or sample):
+                try:
+                    result = self.cap.retrieve()
+                except Exception as exc:
+                    logger.exception("Exception retrieving frame")
+
+            if requested:
+                self._requested.clear()
+                self._result = result
+                self._done.set()
+
+            if sample and result[0]:
+                self._last_on_frame_time = self.last_grab_time
+                try:
+                    self.on_frame(result[1], self.last_grab_time)
+                except Exception as exc:
+                    logger.exception("Exception in frame callback")
+
+            if not success:
+                time.sleep(grab_retry_delay_s)
@@ -1,15 +1,247 @@
 import cv2
+import logging
 import os
+import threading
 import time
+from queue import Queue
+
+from shared.frame_archive import FrameArchiveWriter, archive_name, split_archive_ref
+from shared.frame_index import FrameIndex
+from shared.image_files import reduced_dir_name, reduced_image_path, reduction_factors
+from .retention import RetentionManager
+
+logger = logging.getLogger(__name__)
+
+default_queue_size = 8
+default_writer_workers = 2
+default_codec = "png"
+
+# File extension, OpenCV parameter and allowed range of quality setting for each codec.
+#   For png the quality setting is the compression level, 0 being fastest.
+#   webp-lossless ignores the quality setting
+codecs = {
+    "png": (".png", cv2.IMWRITE_PNG_COMPRESSION, (0, 9)),
+    "jpg": (".jpg", cv2.IMWRITE_JPEG_QUALITY, (0, 100)),
+    "webp": (".webp", cv2.IMWRITE_WEBP_QUALITY, (1, 100)),
+    "webp-lossless": (".webp", cv2.IMWRITE_WEBP_QUALITY, None),
+}
+
+
+def encoding_parameters(codec: str, quality: int = None):
+    if codec not in codecs:
+        raise ValueError(
+            f"Unknown codec '{codec}'. Available codecs: {', '.join(codecs)}"
+        )
+    extension, flag, quality_range = codecs[codec]
+    if quality_range is None:
+        # Quality above 100 selects lossless compression in OpenCV
+        return extension, [flag, 101]
+    if quality is None:
+        return extension, []
+    low, high = quality_range
+    if not low <= quality <= high:
+        raise ValueError(
+            f"Quality {quality} outside allowed range [{low}, {high}] for codec '{codec}'"
+        )
+    return extension, [flag, int(quality)]
+
+
+class WriterQueue:
+    """
+    Bounded queue of frames encoded and written by background threads.
+
+    Capture threads return to the stream as soon as the frame is queued. If the
+    queue is full, put() blocks until a worker has finished an image, so frames
+    are never dropped. Can be shared between several ImageWriters.
+
+    Attributes:
+        maxsize: Maximum number of frames waiting to be written
+        workers: Number of encoding threads
+    """
+
+    def __init__(
+        self, maxsize: int = default_queue_size, workers: int = default_writer_workers
+    ):
+        self.maxsize = maxsize
+        self.workers = workers
+
+        self._queue = Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self.nbr_of_written_images = 0
+        self.last_encode_latency_s = None
+        self.max_encode_latency_s = 0
+        self._total_encode_latency_s = 0
+
+        self._threads = [
+            threading.Thread(
+                target=self._work, name=f"writer-{i}", daemon=True
+            )
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    @property
+    def mean_encode_latency_s(self):
+        with self._lock:
+            if not self.nbr_of_written_images:
+                return None
+            return self._total_encode_latency_s / self.nbr_of_written_images
+
+    # write is called as write(filename, frame) in a worker thread, and returns True on success
+    def put(self, write, filename, frame):
+        if self._queue.full():
+            logger.warning(f"Writer queue full ({self.maxsize} images), waiting")
+        self._queue.put((write, filename, frame))
+
+    # Write all queued images and stop worker threads
+    def close(self):
+        if not any(thread.is_alive() for thread in self._threads):
+            return
+        logger.info(f"Draining writer queue ({self.queue_depth} images)")
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            write, filename, frame = item
+            t0 = time.perf_counter()
+            try:
+                if not write(filename, frame):
+                    logger.error(f"Could not write {filename}")
+            except Exception as exc:
+                logger.exception(f"Exception writing {filename}")
+            latency_s = time.perf_counter() - t0
+            with self._lock:
+                self.nbr_of_written_images += 1
+                self.last_encode_latency_s = latency_s
+                self.max_encode_latency_s = max(self.max_encode_latency_s, latency_s)
+                self._total_encode_latency_s += latency_s
+            logger.debug(
+                f"Wrote {filename} in {latency_s:.3f} s, queue depth {self.queue_depth}"
+            )
 
 
 class ImageWriter:
-    def __init__(self, description: str):
+    """
+    Encode frames and write them, with thumbnails, as loose files or to per-day archives.
+
+    Attributes:
+        description: Image folder, also used as file name prefix
+        queue: Optional background writer, may be shared between cameras
+        codec: Image format, one of codecs
+        quality: Codec quality setting, see codecs
+        thumbnails: Factors of downscaled copies written alongside each image
+        archive: If True, append images to <description>/<description>-<date>.tar
+            instead of writing one file per image
+        retention: Optional thinning and deletion of old images after each write
+        index: If True, add each image to the frame index of the folder, see
+            shared.frame_index
+    """
+
+    def __init__(
+        self,
+        description: str,
+        queue: WriterQueue = None,
+        codec: str = default_codec,
+        quality: int = None,
+        thumbnails: tuple[int] = (),
+        retention: RetentionManager = None,
+        archive: bool = False,
+        index: bool = False,
+    ):
         self.description = description
+        # Optional background writer, may be shared between cameras
+        self.queue = queue
+        if archive and retention is not None:
+            raise ValueError(
+                "Retention of individual images is not supported in archives"
+            )
+        self.retention = retention
+        self.archive = archive
+        self._archive_writers = {}
+        self._archive_lock = threading.Lock()
+        self.index = FrameIndex(description) if index else None
+        self.extension, self.params = encoding_parameters(codec, quality)
+        self.last_write_s = None
         os.makedirs(self.description, exist_ok=True)
 
-    # Write image to disc
-    def write(self, frame):
-        timestamp = time.strftime("%Y-%m-%d-%H-%M-%S")
-        filename = os.path.join(self.description, f"{self.description}-{timestamp}.png")
-        cv2.imwrite(filename, frame)
+        # Downscaled copies written alongside each image, so readers can decode less
+        for factor in thumbnails:
+            if factor not in reduction_factors:
+                raise ValueError(
+                    f"Illegal thumbnail factor {factor}. Allowed factors are {reduction_factors}"
+                )
+            if not archive:
+                os.makedirs(
+                    os.path.join(self.description, reduced_dir_name(factor)),
+                    exist_ok=True,
+                )
+        self.thumbnails = sorted(thumbnails)
+
+    # Write image to disc. timestamp is seconds since epoch, default is current time
+    def write(self, frame, timestamp: float = None):
+        date_str = time.strftime("%Y-%m-%d-%H-%M-%S", time.localtime(timestamp))
+        folder = self.description
+        if self.archive:
+            # Reference to image inside archive, see shared.frame_archive
+            folder = os.path.join(folder, archive_name(self.description, timestamp))
+        filename = os.path.join(
+            folder, f"{self.description}-{date_str}{self.extension}"
+        )
+        if self.queue is None:
+            self._write(filename, frame)
+        else:
+            self.queue.put(self._write, filename, frame)
+
+    def _write(self, filename, frame):
+        t0 = time.perf_counter()
+        success = self._write_file(filename, frame)
+
+        # Each thumbnail is downscaled from the previous one, which is cheaper than from full size
+        height, width = frame.shape[:2]
+        reduced = frame
+        for factor in self.thumbnails:
+            reduced = cv2.resize(
+                reduced,
+                (max(width // factor, 1), max(height // factor, 1)),
+                interpolation=cv2.INTER_AREA,
+            )
+            success &= self._write_file(reduced_image_path(filename, factor), reduced)
+        self.last_write_s = time.perf_counter() - t0
+        if success and self.retention is not None:
+            self.retention.add(filename, self.thumbnails)
+        if success and self.index is not None:
+            self.index.add(filename, width=width, height=height)
+        return success
+
+    def _write_file(self, filename, frame):
+        if not self.archive:
+            return cv2.imwrite(filename, frame, self.params)
+        success, data = cv2.imencode(self.extension, frame, self.params)
+        if not success:
+            return False
+        archive, member = split_archive_ref(filename)
+        return self._archive_writer(archive).append(member, data.tobytes())
+
+    # One writer per archive, so that appends from several worker threads are serialized
+    def _archive_writer(self, archive):
+        with self._archive_lock:
+            if archive not in self._archive_writers:
+                self._archive_writers[archive] = FrameArchiveWriter(archive)
+            return self._archive_writers[archive]
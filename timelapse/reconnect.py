@@ -0,0 +1,85 @@
+import logging
+import random
+import socket
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+default_immediate_retries = 1
+default_base_delay_s = 2
+default_max_delay_s = 600
+default_jitter = 0.5
+default_probe_timeout_s = 2
+
+# Port probed when the stream url does not give one
+default_ports = {"rtsp": 554, "http": 80, "https": 443}
+
+
+class ReconnectStrategy:
+    """
+    Wait times between reconnection attempts, and a fast reachability check.
+
+    After a failure, the stream is reopened immediately for the first
+    immediate_retries failures, as a single dropped read on a healthy camera is
+    the most common case. After that, the wait doubles with each failure from
+    base_delay_s up to max_delay_s. The wait is randomly shortened by up to
+    the jitter fraction, so that cameras failing together do not reconnect in
+    lockstep.
+
+    Before a stream is opened, a TCP connection to the camera is attempted.
+    An unreachable camera then fails within probe_timeout_s, instead of
+    blocking on the much longer timeout of cv2.VideoCapture.
+
+    Attributes:
+        immediate_retries: Number of failures retried without waiting
+        base_delay_s: Wait after the first failure not retried immediately
+        max_delay_s: Longest wait
+        jitter: Fraction, 0-1, of the wait that is randomized
+        probe_timeout_s: Timeout of TCP probe, None disables probing
+    """
+
+    def __init__(
+        self,
+        immediate_retries: int = default_immediate_retries,
+        base_delay_s: float = default_base_delay_s,
+        max_delay_s: float = default_max_delay_s,
+        jitter: float = default_jitter,
+        probe_timeout_s: float = default_probe_timeout_s,
+    ):
+        if not 0 <= jitter <= 1:
+            raise ValueError(f"Jitter {jitter} outside allowed range [0, 1]")
+        self.immediate_retries = immediate_retries
+        self.base_delay_s = base_delay_s
+        self.max_delay_s = max_delay_s
+        self.jitter = jitter
+        self.probe_timeout_s = probe_timeout_s
+
+    # Seconds to wait before reconnecting after nbr_of_failures consecutive failures
+    def delay(self, nbr_of_failures: int):
+        backoff_steps = nbr_of_failures - self.immediate_retries
+        if backoff_steps <= 0:
+            return 0
+        # Limit exponent, as the number of failures grows without bound for a camera that is down
+        delay_s = min(
+            self.base_delay_s * 2 ** min(backoff_steps - 1, 32), self.max_delay_s
+        )
+        return delay_s * (1 - self.jitter * random.random())
+
+    def is_reachable(self, url: str):
+        """Return False if a TCP connection to the host of url cannot be made"""
+        if self.probe_timeout_s is None or not url:
+            return True
+        try:
+            parts = urlsplit(url)
+            host = parts.hostname
+            port = parts.port or default_ports.get(parts.scheme)
+        except ValueError:
+            return True
+        if host is None or port is None:
+            return True
+        try:
+            with socket.create_connection((host, port), timeout=self.probe_timeout_s):
+                return True
+        except OSError as exc:
+            logger.debug(f"Probe of {host}:{port} failed: {exc}")
+            return False
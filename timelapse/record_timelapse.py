@@ -1,6 +1,24 @@
-from shared.parse_camera_settings import parse_camera_settings
+import signal
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from shared.parse_camera_settings import parse_camera_settings, parse_storage_settings
 from test.test_timelapse_capture import TestTimelapseCapture
-from .timelapse_capture import TimelapseCapture
+from .capture_metrics import MetricsExporter
+from .burst_recorder import BurstRecorder, default_burst_fps
+from .capture_scheduler import CaptureScheduler, load_schedule
+from .duplicate_filter import DuplicateFilter
+from .image_writer import ImageWriter, WriterQueue, default_writer_workers
+from .reconnect import (
+    ReconnectStrategy,
+    default_base_delay_s,
+    default_immediate_retries,
+    default_max_delay_s,
+    default_probe_timeout_s,
+)
+from .retention import RetentionManager, bytes_per_gb, default_daily_time
+from .timelapse_capture import TimelapseCapture, snapshot_attempts
 
 
 def create_network_camera(
@@ -9,26 +27,213 @@ def create_network_camera(
     flush_frames: int,
     image_interval_s: float,
     test: bool = False,
+    test_mode: str = "humanoids",
+    writer_queue: WriterQueue = None,
+    background_grab: bool = False,
+    align_to_clock: bool = False,
+    dedup_threshold: float = None,
+    burst_s: tuple[float, float] = None,
+    burst_fps: float = default_burst_fps,
+    motion_threshold: float = None,
+    retain_gb: float = None,
+    min_free_gb: float = None,
+    thin_days: tuple[float, float] = None,
+    daily_time: str = default_daily_time,
+    immediate_retries: int = default_immediate_retries,
+    backoff_s: tuple[float, float] = (default_base_delay_s, default_max_delay_s),
+    probe_timeout_s: float = default_probe_timeout_s,
 ):
 
     rtsp_url = parse_camera_settings(cam_stream)
+    retention = None
+    if retain_gb or min_free_gb or thin_days:
+        full_rate_days, hourly_days = thin_days or (None, None)
+        retention = RetentionManager(
+            description=description,
+            budget_bytes=retain_gb * bytes_per_gb if retain_gb else None,
+            min_free_bytes=min_free_gb * bytes_per_gb if min_free_gb else None,
+            full_rate_days=full_rate_days,
+            hourly_days=hourly_days,
+            daily_time=daily_time,
+        )
+    image_writer = ImageWriter(
+        description=description,
+        queue=writer_queue,
+        retention=retention,
+        **parse_storage_settings(cam_stream),
+    )
+    burst_recorder = None
+    if burst_s:
+        pre_s, post_s = burst_s
+        burst_recorder = BurstRecorder(
+            description=description,
+            pre_s=pre_s,
+            post_s=post_s,
+            burst_fps=burst_fps,
+            motion_threshold=motion_threshold,
+            extension=image_writer.extension,
+            params=image_writer.params,
+            retention=retention,
+        )
     input_args = {
         "url": rtsp_url,
         "description": description,
         "flush_frames": flush_frames,
         "image_interval_s": image_interval_s,
+        "image_writer": image_writer,
+        "background_grab": background_grab,
+        "align_to_clock": align_to_clock,
+        "duplicate_filter": (
+            DuplicateFilter(description=description, threshold=dedup_threshold)
+            if dedup_threshold
+            else None
+        ),
+        "burst_recorder": burst_recorder,
+        "reconnect": ReconnectStrategy(
+            immediate_retries=immediate_retries,
+            base_delay_s=backoff_s[0],
+            max_delay_s=backoff_s[1],
+            # Probing is disabled with a timeout of 0, and for synthetic test frames,
+            #   which do not depend on the camera
+            probe_timeout_s=None if test else probe_timeout_s or None,
+        ),
     }
     if test:
-        cam = TestTimelapseCapture(test_mode="humanoids", **input_args)
+        cam = TestTimelapseCapture(test_mode=test_mode, **input_args)
     else:
         cam = TimelapseCapture(**input_args)
     return cam
 
 
-def record_timelapse(cam: TimelapseCapture, persistent: bool, snapshot: bool):
-    if snapshot:
-        cam.snapshot_capture()
-    else:
-        cam.start_capture(continuous_capture=persistent)
+# Exit through normal interpreter shutdown when stopped by systemd, so that
+#   queued images are written before the process ends
+def _exit_on_sigterm():
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+
+# Record bursts on all cameras when receiving SIGUSR1, e.g. kill -USR1 <pid>
+def _burst_on_sigusr1(cams: list[TimelapseCapture]):
+    recorders = [cam.burst_recorder for cam in cams if cam.burst_recorder is not None]
+    if recorders:
+        signal.signal(
+            signal.SIGUSR1,
+            lambda signum, frame: [recorder.trigger() for recorder in recorders],
+        )
+
+
+def _close(cams: list[TimelapseCapture]):
+    for cam in cams:
+        if cam.burst_recorder is not None:
+            cam.burst_recorder.close()
+
+
+def record_timelapse(
+    cam: TimelapseCapture,
+    persistent: bool,
+    snapshot: bool,
+    metrics_port: int = None,
+    metrics_file: str = None,
+):
+    _exit_on_sigterm()
+    _burst_on_sigusr1([cam])
+    exporter = MetricsExporter(
+        cams=[cam],
+        writer_queue=cam.image_writer.queue,
+        port=metrics_port,
+        textfile=metrics_file,
+    ).start()
+    try:
+        if snapshot:
+            cam.snapshot_capture()
+        else:
+            cam.start_capture(continuous_capture=persistent)
+    finally:
+        # Write images still waiting in queue before exiting
+        if cam.image_writer.queue is not None:
+            cam.image_writer.queue.close()
+        _close([cam])
+        exporter.stop()
 
     return cam
+
+
+# Capture one image from each camera at the same time. All images get the same
+#   timestamp in their file names. Returns success of each camera
+def record_snapshots(
+    cams: list[TimelapseCapture],
+    timestamp: float = None,
+    attempts: int = snapshot_attempts,
+):
+    timestamp = timestamp or time.time()
+    with ThreadPoolExecutor(
+        max_workers=len(cams), thread_name_prefix="snapshot"
+    ) as executor:
+        return list(
+            executor.map(
+                lambda cam: cam.snapshot(timestamp=timestamp, attempts=attempts), cams
+            )
+        )
+
+
+# Capture from all jobs in schedule file in a single process
+def record_schedule(
+    schedule_file,
+    default_flush_frames: int,
+    default_image_interval_s: float,
+    persistent: bool,
+    capture_workers: int = None,
+    writer_workers: int = default_writer_workers,
+    test: bool = False,
+    metrics_port: int = None,
+    metrics_file: str = None,
+):
+    schedule = load_schedule(schedule_file)
+    _exit_on_sigterm()
+
+    with WriterQueue(workers=writer_workers) as writer_queue:
+        cams = [
+            create_network_camera(
+                cam_stream=job["cam"],
+                description=description,
+                flush_frames=job.get("flush", default_flush_frames),
+                image_interval_s=job.get("interval", default_image_interval_s),
+                test=test,
+                writer_queue=writer_queue,
+                background_grab=persistent and job.get("background_grab", False),
+                align_to_clock=job.get("align", False),
+                dedup_threshold=job.get("dedup"),
+                burst_s=job.get("burst") if persistent else None,
+                burst_fps=job.get("burst_fps", default_burst_fps),
+                motion_threshold=job.get("motion"),
+                retain_gb=job.get("retain_gb"),
+                min_free_gb=job.get("min_free_gb"),
+                thin_days=job.get("thin"),
+                daily_time=job.get("daily_time", default_daily_time),
+                immediate_retries=job.get(
+                    "immediate_retries", default_immediate_retries
+                ),
+                backoff_s=job.get(
+                    "backoff", (default_base_delay_s, default_max_delay_s)
+                ),
+                probe_timeout_s=job.get("probe_timeout", default_probe_timeout_s),
+            )
+            for description, job in schedule.items()
+        ]
+
+        scheduler = CaptureScheduler(
+            cams=cams, persistent=persistent, capture_workers=capture_workers
+        )
+        exporter = MetricsExporter(
+            cams=cams,
+            writer_queue=writer_queue,
+            port=metrics_port,
+            textfile=metrics_file,
+        ).start()
+        _burst_on_sigusr1(cams)
+        try:
+            scheduler.run()
+        finally:
+            _close(cams)
+            exporter.stop()
+
+    return scheduler
@@ -0,0 +1,288 @@
+import logging
+import os
+import shutil
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+
+from shared.image_files import (
+    bursts_dir,
+    filename_to_date,
+    image_extensions,
+    reduced_dir_name,
+    reduced_image_path,
+    reduction_factors,
+)
+
+logger = logging.getLogger(__name__)
+
+default_full_rate_days = 7
+default_hourly_days = 30
+default_daily_time = "12:00"
+bytes_per_gb = 1024**3
+
+
+class RetentionManager:
+    """
+    Keep an image folder within a disk budget by thinning and deleting old frames.
+
+    Frames younger than full_rate_days are all kept. Older frames are thinned
+    to the first frame of each hour, and frames older than hourly_days to the
+    frame closest to daily_time of each day. If the folder still exceeds
+    budget_bytes, or the disk has less than min_free_bytes free, the oldest
+    frames are deleted. Thumbnails are deleted with their images. Bursts count
+    towards the budget, and are deleted whole, in time order with the frames.
+
+    The folder is scanned once on creation. After that, ImageWriter reports
+    each new image through add(), and frames are moved between tiers as they
+    age, so the work per image does not grow with the number of stored frames.
+    BurstRecorder reports each burst frame through add_burst_frame().
+
+    Attributes:
+        description: Image folder
+        budget_bytes: Largest total size of images, thumbnails and bursts, None for
+            no limit
+        min_free_bytes: Smallest free space on disk, None for no limit
+        full_rate_days: Keep all frames this many days, None disables thinning
+        hourly_days: Keep hourly frames this many days, None keeps hourly frames
+            until deleted by budget
+        daily_time: Time of day "HH:MM" of the frame kept for older days
+    """
+
+    def __init__(
+        self,
+        description: str,
+        budget_bytes: int = None,
+        min_free_bytes: int = None,
+        full_rate_days: float = None,
+        hourly_days: float = None,
+        daily_time: str = default_daily_time,
+    ):
+        if hourly_days is not None and (
+            full_rate_days is None or hourly_days <= full_rate_days
+        ):
+            raise ValueError(
+                f"Hourly tier ({hourly_days} days) must end after full rate tier ({full_rate_days} days)"
+            )
+        self.description = description
+        self.budget_bytes = budget_bytes
+        self.min_free_bytes = min_free_bytes
+        self.full_rate_days = full_rate_days
+        self.hourly_days = hourly_days
+        daily_h, daily_m = (int(x) for x in daily_time.split(":"))
+        self._daily_seconds = daily_h * 3600 + daily_m * 60
+
+        self.total_bytes = 0
+        self.nbr_of_deleted_images = 0
+        self.nbr_of_deleted_bursts = 0
+        self._lock = threading.Lock()
+        # Frames as (date, filename, bytes) in time order, oldest tier first
+        self._daily = deque()
+        self._pending_day = []
+        self._hourly = deque()
+        self._full = deque()
+        self._last_hour = None
+        # Burst folder to [date, bytes], in time order
+        self._bursts = {}
+
+        for date, filename, nbytes in self._scan():
+            self._full.append((date, filename, nbytes))
+            self.total_bytes += nbytes
+        for date, folder, nbytes in self._scan_bursts():
+            self._bursts[folder] = [date, nbytes]
+            self.total_bytes += nbytes
+        logger.info(
+            f"Retention of {description}: {len(self._full)} images, "
+            f"{len(self._bursts)} bursts, {self.total_bytes / bytes_per_gb:.2f} GB"
+        )
+        self.enforce()
+
+    # Register an image written by ImageWriter, then thin and delete as needed
+    def add(self, filename, thumbnails=()):
+        nbytes = self._file_size(filename)
+        for factor in thumbnails:
+            nbytes += self._file_size(reduced_image_path(filename, factor))
+        date = filename_to_date(os.path.basename(filename))
+        with self._lock:
+            self.total_bytes += nbytes
+            # Writer threads may finish slightly out of order
+            index = len(self._full)
+            while index > 0 and self._full[index - 1][0] > date:
+                index -= 1
+            self._full.insert(index, (date, filename, nbytes))
+        self.enforce()
+
+    # Register a frame written by BurstRecorder, then delete as needed
+    def add_burst_frame(self, filename):
+        nbytes = self._file_size(filename)
+        folder = os.path.dirname(filename)
+        with self._lock:
+            if folder not in self._bursts:
+                self._bursts[folder] = [filename_to_date(os.path.basename(folder)), 0]
+            self._bursts[folder][1] += nbytes
+            self.total_bytes += nbytes
+        self.enforce()
+
+    def enforce(self, now: datetime = None):
+        now = now or datetime.now()
+        with self._lock:
+            if self.full_rate_days is not None:
+                self._thin(now)
+            self._delete_over_budget()
+
+    @property
+    def nbr_of_images(self):
+        return (
+            len(self._daily)
+            + len(self._pending_day)
+            + len(self._hourly)
+            + len(self._full)
+        )
+
+    # One pass over the folder and its thumbnail folders on startup
+    def _scan(self):
+        if not os.path.isdir(self.description):
+            return []
+        thumbnail_sizes = {}
+        for factor in reduction_factors:
+            folder = os.path.join(self.description, reduced_dir_name(factor))
+            if os.path.isdir(folder):
+                with os.scandir(folder) as entries:
+                    for entry in entries:
+                        thumbnail_sizes[entry.name] = (
+                            thumbnail_sizes.get(entry.name, 0) + entry.stat().st_size
+                        )
+        frames = []
+        with os.scandir(self.description) as entries:
+            for entry in entries:
+                if not entry.is_file() or not entry.name.endswith(image_extensions):
+                    continue
+                try:
+                    date = filename_to_date(entry.name)
+                except Exception:
+                    continue
+                nbytes = entry.stat().st_size + thumbnail_sizes.get(entry.name, 0)
+                frames.append((date, entry.path, nbytes))
+        return sorted(frames)
+
+    def _scan_bursts(self):
+        folder = os.path.join(self.description, bursts_dir)
+        if not os.path.isdir(folder):
+            return []
+        bursts = []
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if not entry.is_dir():
+                    continue
+                try:
+                    date = filename_to_date(entry.name)
+                except Exception:
+                    continue
+                with os.scandir(entry.path) as files:
+                    nbytes = sum(f.stat().st_size for f in files if f.is_file())
+                bursts.append((date, entry.path, nbytes))
+        return sorted(bursts)
+
+    def _thin(self, now):
+        # Full rate to hourly: keep first frame of each hour
+        hourly_cutoff = now - timedelta(days=self.full_rate_days)
+        while self._full and self._full[0][0] < hourly_cutoff:
+            frame = self._full.popleft()
+            hour = frame[0].replace(minute=0, second=0)
+            if hour == self._last_hour:
+                self._delete(frame)
+            else:
+                self._last_hour = hour
+                self._hourly.append(frame)
+
+        if self.hourly_days is None:
+            return
+
+        # Hourly to daily: collect frames of a day, keep the one closest to daily time
+        daily_cutoff = now - timedelta(days=self.hourly_days)
+        while self._hourly and self._hourly[0][0] < daily_cutoff:
+            frame = self._hourly.popleft()
+            if self._pending_day and self._pending_day[0][0].date() != frame[0].date():
+                self._close_pending_day()
+            self._pending_day.append(frame)
+        if (
+            self._pending_day
+            and self._pending_day[0][0].date() < daily_cutoff.date()
+        ):
+            self._close_pending_day()
+
+    def _close_pending_day(self):
+        keep = min(
+            self._pending_day,
+            key=lambda frame: abs(
+                frame[0].hour * 3600
+                + frame[0].minute * 60
+                + frame[0].second
+                - self._daily_seconds
+            ),
+        )
+        for frame in self._pending_day:
+            if frame is not keep:
+                self._delete(frame)
+        self._daily.append(keep)
+        self._pending_day = []
+
+    def _over_budget(self):
+        if self.budget_bytes is not None and self.total_bytes > self.budget_bytes:
+            return True
+        if self.min_free_bytes is not None:
+            return shutil.disk_usage(self.description).free < self.min_free_bytes
+        return False
+
+    # Delete oldest frames and bursts first, but never the newest frame
+    def _delete_over_budget(self):
+        tiers = (self._daily, self._pending_day, self._hourly, self._full)
+        while self._over_budget() and (self._bursts or self.nbr_of_images > 1):
+            burst = next(iter(self._bursts), None)
+            tier = (
+                next(tier for tier in tiers if tier) if self.nbr_of_images > 1 else None
+            )
+            if burst is not None and (
+                tier is None or self._bursts[burst][0] <= tier[0][0]
+            ):
+                self._delete_burst(burst)
+            else:
+                self._delete(tier.pop(0) if isinstance(tier, list) else tier.popleft())
+        if self._over_budget():
+            logger.warning(f"Retention budget of {self.description} cannot be met")
+
+    # Files may already be gone, e.g. after download_images_and_movies.py --delete-remote,
+    #   which also corrects the size accounting as the oldest frames are deleted first
+    def _delete(self, frame):
+        _, filename, nbytes = frame
+        for path in [filename] + [
+            reduced_image_path(filename, factor) for factor in reduction_factors
+        ]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as exc:
+                logger.error(f"Could not delete {path}: {exc}")
+        self.total_bytes -= nbytes
+        self.nbr_of_deleted_images += 1
+        logger.debug(f"Deleted {filename}")
+
+    def _delete_burst(self, folder):
+        _, nbytes = self._bursts.pop(folder)
+        try:
+            shutil.rmtree(folder)
+        except FileNotFoundError:
+            pass
+        except OSError as exc:
+            logger.error(f"Could not delete {folder}: {exc}")
+        self.total_bytes -= nbytes
+        self.nbr_of_deleted_bursts += 1
+        logger.debug(f"Deleted burst {folder}")
+
+    @staticmethod
+    def _file_size(path):
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
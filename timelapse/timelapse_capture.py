@@ -1,7 +1,12 @@
 import cv2
+import math
 import time
 import logging
+from .burst_recorder import BurstRecorder
+from .duplicate_filter import DuplicateFilter
+from .frame_grabber import FrameGrabber
 from .image_writer import ImageWriter
+from .reconnect import ReconnectStrategy
 
 logging.basicConfig(
     level=logging.INFO,
@@ -11,24 +16,60 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
+# Attempts to capture a snapshot
+snapshot_attempts = 3
+
 
 class TimelapseCapture:
 
     def __init__(
-        self, *, url: str, description: str, flush_frames: int, image_interval_s: float
+        self,
+        *,
+        url: str,
+        description: str,
+        flush_frames: int,
+        image_interval_s: float,
+        image_writer: ImageWriter = None,
+        background_grab: bool = False,
+        align_to_clock: bool = False,
+        duplicate_filter: DuplicateFilter = None,
+        burst_recorder: BurstRecorder = None,
+        reconnect: ReconnectStrategy = None,
     ):
 
         self.url = url
         self.cap = None
+        # Drain stream in a background thread instead of flushing before each capture
+        self.background_grab = background_grab
+        self.grabber = None
 
         self.is_connected = False
         self.flush_frames = flush_frames
         self.image_interval_s = image_interval_s
+        # Capture on wall clock multiples of image_interval_s, e.g. :00, :10, :20 for 600 s
+        self.align_to_clock = align_to_clock
+        self._next_slot = None
+        self.nbr_of_missed_slots = 0
 
         self.nbr_of_failed_captures = 0
         self.delay_start_s = 0
+        # Wait times between reconnection attempts after failures
+        self.reconnect = reconnect or ReconnectStrategy()
+
+        # Statistics for monitoring
+        self.nbr_of_captures = 0
+        self.nbr_of_read_errors = 0
+        self.nbr_of_open_errors = 0
+        self.stream_open_s = None
+        self.read_s = None
+        self.last_capture_time = None
 
-        self.image_writer = ImageWriter(description=description)
+        self.description = description
+        self.image_writer = image_writer or ImageWriter(description=description)
+        # Optional check for near-duplicate frames, which are then not stored
+        self.duplicate_filter = duplicate_filter
+        # Optional recording of short bursts around events, fed by the grabber thread
+        self.burst_recorder = burst_recorder
 
     # Override to use mockup HW
     def _create_capture(self):
@@ -45,24 +86,27 @@ class TimelapseCapture:
 
     # Capture single snapshot
     def snapshot_capture(self):
-        while True:
-            try:
-                self._restart()
-                # Check if restart was successful before proceeding in loop
-                if self.is_connected:
-                    success = self._capture_image()
-                    # Only wait if image capture was successful
-                    if success:
-                        self._release_capture()
-                        return
+        return self.snapshot()
 
+    # Open stream, capture one image and release stream. The first attempt starts
+    #   immediately, failed attempts are retried after a short delay.
+    # timestamp is used in the file name, e.g. shared by several cameras, default is capture time
+    def snapshot(self, timestamp: float = None, attempts: int = snapshot_attempts):
+        for attempt in range(attempts):
+            time.sleep(self.reconnect.delay(attempt))
+            try:
+                self._open_capture()
+                success = self.is_connected and self._capture_image(timestamp)
             except Exception as exc:
-                logger.exception("Exception during intermittent capture")
-                time.sleep(600)
-
-            if self.nbr_of_failed_captures > 5:
-                logger.exception("Cannot capture image. Aborting")
-                return
+                logger.exception(f"Exception during snapshot ({self.description})")
+                success = False
+            finally:
+                self._release_capture()
+            if success:
+                return True
+            self.nbr_of_failed_captures += 1
+        logger.error(f"Cannot capture image from {self.description}. Aborting")
+        return False
 
     def _continuous_capture(self):
         # Open stream
@@ -70,69 +114,190 @@ class TimelapseCapture:
             try:
                 self._restart()
             except Exception as exc:
-                logger.exeption("Exception when opening stream")
+                logger.exception("Exception when opening stream")
+            if not self.is_connected:
+                self.nbr_of_failed_captures += 1
+
+        if self.align_to_clock:
+            time.sleep(self._next_capture_delay())
 
         # Capture timelapse images
         while True:
             try:
-                success = self._capture_image()
-                if success:
-                    self.nbr_of_failed_captures = 0
-                    self.delay_start_s = 0
-                    time.sleep(self.image_interval_s)
-                else:
-                    self.nbr_of_failed_captures += 1
-                    self._restart()
+                success = self.is_connected and self._capture_image()
             except Exception as exc:
                 logger.exception("Exception during persistent capture")
-                self._restart()
+                success = False
+
+            if success:
+                self.nbr_of_failed_captures = 0
+                self.delay_start_s = 0
+                time.sleep(self._next_capture_delay())
+            else:
+                self.nbr_of_failed_captures += 1
+                try:
+                    self._restart()
+                except Exception as exc:
+                    logger.exception("Exception when opening stream")
+
+    # Run a single capture cycle without blocking between captures, for use by
+    #   an external scheduler driving several cameras from one process.
+    # Returns number of seconds to wait before the next call
+    def capture_step(self, persistent=True):
+        if self.align_to_clock and self._next_slot is None:
+            return self._next_capture_delay()
+
+        try:
+            if not self.is_connected:
+                self._open_capture()
+            success = self.is_connected and self._capture_image()
+        except Exception as exc:
+            logger.exception(f"Exception during capture step ({self.description})")
+            success = False
+
+        if not success or not persistent:
+            self._release_capture()
+
+        if success:
+            self.nbr_of_failed_captures = 0
+            self.delay_start_s = 0
+            return self._next_capture_delay()
+
+        self.nbr_of_failed_captures += 1
+        self._update_backoff()
+        if self.delay_start_s:
+            logger.info(
+                f"{self.nbr_of_failed_captures} consecutive failed captures. Waiting {self.delay_start_s:.1f} seconds"
+            )
+        return self.delay_start_s
 
     def _intermittent_capture(self):
+        if self.align_to_clock:
+            time.sleep(self._next_capture_delay())
+
         while True:
             try:
                 self._restart()
-                # Check if restart was successful before proceeding in loop
-                if self.is_connected:
-                    success = self._capture_image()
-                    # Only wait if image capture was successful
-                    if success:
-                        self._release_capture()
-                        time.sleep(self.image_interval_s)
+                success = self.is_connected and self._capture_image()
             except Exception as exc:
                 logger.exception("Exception during intermittent capture")
-                time.sleep(10)
+                success = False
 
-    def _capture_image(self):
-        # Workaround for tapo camera
-        if self.flush_frames:
-            time.sleep(1)
-            for i in range(self.flush_frames):
-                success = self.cap.grab()
-                if not success:
-                    logger.debug(f"Flushing error {i} / self.flush_frames")
-            time.sleep(1)
+            # Only wait for next capture if image capture was successful
+            if success:
+                self.nbr_of_failed_captures = 0
+                self.delay_start_s = 0
+                self._release_capture()
+                time.sleep(self._next_capture_delay())
+            else:
+                self.nbr_of_failed_captures += 1
 
-        # Capture frame
-        success, frame = self.cap.read()
+    def _capture_image(self, timestamp: float = None):
+        t0 = time.perf_counter()
+        if self.grabber is not None:
+            # Stream is continuously drained, so the next frame is fresh
+            success, frame = self.grabber.read()
+        else:
+            # Workaround for tapo camera
+            if self.flush_frames:
+                time.sleep(1)
+                for i in range(self.flush_frames):
+                    success = self.cap.grab()
+                    if not success:
+                        logger.debug(f"Flushing error {i} / self.flush_frames")
+                time.sleep(1)
+
+            # Capture frame
+            t0 = time.perf_counter()
+            success, frame = self.cap.read()
+        self.read_s = time.perf_counter() - t0
 
         if success:
-            self.image_writer.write(frame)
-            logger.info("Saved image")
+            self.nbr_of_captures += 1
+            self.last_capture_time = time.time()
+            if timestamp is None:
+                timestamp = self._slot_timestamp()
+            if self.duplicate_filter is not None and self.duplicate_filter.is_duplicate(
+                frame, timestamp
+            ):
+                return success
+            self.image_writer.write(frame, timestamp=timestamp)
+            queue = self.image_writer.queue
+            if queue is None:
+                logger.info("Saved image")
+            else:
+                latency_s = queue.mean_encode_latency_s
+                logger.info(
+                    f"Queued image, writer queue depth {queue.queue_depth}"
+                    + (f", mean encode latency {latency_s:.3f} s" if latency_s else "")
+                )
         else:
+            self.nbr_of_read_errors += 1
             logger.error("Image capturing error")
         return success
 
+    # Seconds to wait until next capture after a successful one
+    def _next_capture_delay(self):
+        if not self.align_to_clock:
+            return self.image_interval_s
+
+        # Slots are aligned to local time, so that e.g. daily captures happen at midnight
+        now = time.time()
+        utc_offset_s = time.localtime(now).tm_gmtoff
+        next_slot = (
+            math.floor((now + utc_offset_s) / self.image_interval_s) + 1
+        ) * self.image_interval_s - utc_offset_s
+
+        if self._next_slot is not None:
+            missed_slots = round((next_slot - self._next_slot) / self.image_interval_s) - 1
+            if missed_slots > 0:
+                self.nbr_of_missed_slots += missed_slots
+                logger.warning(
+                    f"Missed {missed_slots} capture slots ({self.nbr_of_missed_slots} in total)"
+                )
+        self._next_slot = next_slot
+        return max(next_slot - time.time(), 0)
+
+    # Time of current slot if capture is aligned and on time, otherwise None to use current time
+    def _slot_timestamp(self):
+        if self._next_slot is None or not self.align_to_clock:
+            return None
+        if abs(time.time() - self._next_slot) < self.image_interval_s / 2:
+            return self._next_slot
+        return None
+
     def _open_capture(self):
+        # Fail fast if camera is unreachable, instead of waiting for the stream to time out
+        if not self.reconnect.is_reachable(self.url):
+            self.nbr_of_open_errors += 1
+            logger.error(f"Camera of {self.description} is not reachable")
+            self.is_connected = False
+            return
+
+        t0 = time.perf_counter()
         self.cap = self._create_capture()
+        self.stream_open_s = time.perf_counter() - t0
 
         if not self.cap.isOpened():
+            self.nbr_of_open_errors += 1
             logger.error("Error opening rtsp stream")
             self.is_connected = False
         else:
             logger.debug("Opening capture successful")
             self.is_connected = True
+            if self.burst_recorder is not None:
+                self.grabber = FrameGrabber(
+                    self.cap,
+                    on_frame=self.burst_recorder.feed,
+                    on_frame_interval_s=1 / self.burst_recorder.burst_fps,
+                ).start()
+            elif self.background_grab:
+                self.grabber = FrameGrabber(self.cap).start()
 
     def _release_capture(self):
+        if self.grabber is not None:
+            self.grabber.stop()
+            self.grabber = None
         if self.cap is not None:
             try:
                 self.cap.release()
@@ -142,20 +307,20 @@ class TimelapseCapture:
         self.cap = None
         self.is_connected = False
 
+    # Count number of failed restarts to determine waiting time
+    def _update_backoff(self):
+        self.delay_start_s = self.reconnect.delay(self.nbr_of_failed_captures)
+
     def _restart(self):
-        # Count number of failed restarts to determine waiting time
-        if self.nbr_of_failed_captures == 3:
-            self.delay_start_s = 30
-        elif self.nbr_of_failed_captures > 3:
-            self.delay_start_s = min(2 * self.delay_start_s, 600)
+        # Release first, so that the camera is not kept busy while waiting
+        self._release_capture()
+
+        self._update_backoff()
         # If previous restarts failed, wait a bit longer
         if self.delay_start_s:
             logger.info(
-                f"{self.nbr_of_failed_captures} consecutive failed captures. Waiting {self.delay_start_s} seconds"
+                f"{self.nbr_of_failed_captures} consecutive failed captures. Waiting {self.delay_start_s:.1f} seconds"
             )
             time.sleep(self.delay_start_s)
 
-        # Restart capture
-        self._release_capture()
-        time.sleep(10)
         self._open_capture()
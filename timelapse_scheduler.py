@@ -0,0 +1,66 @@
+import argparse
+from timelapse.capture_scheduler import schedule_settings_path
+from timelapse.image_writer import default_writer_workers
+from timelapse.record_timelapse import record_schedule
+
+default_flush_frames = 0
+default_image_interval_s = 600
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Time lapse recording with several network cameras in one process"
+    )
+    parser.add_argument(
+        "schedule",
+        nargs="?",
+        default=schedule_settings_path,
+        help=f"File with capture jobs. Default: {schedule_settings_path}",
+    )
+    parser.add_argument("--test", "-t", action="store_true", default=False)
+    parser.add_argument(
+        "--restart-every-cycle",
+        "-r",
+        action="store_true",
+        help="Restart the camera connections on every capture cycle",
+    )
+    parser.add_argument(
+        "--capture-workers",
+        "-c",
+        type=int,
+        default=None,
+        help="Number of cameras capturing at the same time. Default: number of cameras, at most 4",
+    )
+    parser.add_argument(
+        "--writer-workers",
+        "-w",
+        type=int,
+        default=default_writer_workers,
+        help=f"Number of threads encoding images, shared by all cameras. Default: {default_writer_workers}",
+    )
+
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=None,
+        help="Serve capture metrics in Prometheus format on this port",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        default=None,
+        help="Write capture metrics in Prometheus format to this file, e.g. for the node_exporter textfile collector",
+    )
+
+    args = parser.parse_args()
+
+    record_schedule(
+        schedule_file=args.schedule,
+        default_flush_frames=default_flush_frames,
+        default_image_interval_s=default_image_interval_s,
+        persistent=not args.restart_every_cycle,
+        capture_workers=args.capture_workers,
+        writer_workers=args.writer_workers,
+        test=args.test,
+        metrics_port=args.metrics_port,
+        metrics_file=args.metrics_file,
+    )
@@ -0,0 +1,62 @@
+import argparse
+import sys
+from timelapse.record_timelapse import create_network_camera, record_snapshots
+from timelapse.timelapse_capture import snapshot_attempts
+
+default_flush_frames = 0
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Capture one image from each of several network cameras at the same time"
+    )
+    parser.add_argument(
+        "cams",
+        nargs="+",
+        metavar="CAM[=DESCR]",
+        help='Camera id, optionally with image folder, e.g. tapo.highres=garden. Default folder is camera id with "." replaced by "-"',
+    )
+    parser.add_argument(
+        "--test",
+        "-t",
+        nargs="?",
+        const="humanoids",
+        default=None,
+        choices=["humanoids", "gradient", "synthetic"],
+        help="Use mockup cameras. Default mode: humanoids",
+    )
+    parser.add_argument(
+        "--flush",
+        "-f",
+        type=int,
+        default=default_flush_frames,
+        help=f"Number of frames to flush. Default: {default_flush_frames}",
+    )
+    parser.add_argument(
+        "--attempts",
+        type=int,
+        default=snapshot_attempts,
+        help=f"Number of attempts per camera. Default: {snapshot_attempts}",
+    )
+
+    args = parser.parse_args()
+
+    cams = []
+    for cam_descr in args.cams:
+        cam_stream, _, description = cam_descr.partition("=")
+        cams.append(
+            create_network_camera(
+                cam_stream=cam_stream,
+                description=description or cam_stream.replace(".", "-"),
+                flush_frames=args.flush,
+                image_interval_s=0,
+                test=args.test is not None,
+                test_mode=args.test,
+            )
+        )
+
+    results = record_snapshots(cams, attempts=args.attempts)
+    failed = [cam.description for cam, success in zip(cams, results) if not success]
+    if failed:
+        print(f"No image from: {', '.join(failed)}")
+        sys.exit(1)
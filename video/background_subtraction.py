@@ -0,0 +1,162 @@
+import math
+
+import cv2
+import numpy as np
+
+"""
+Background subtraction over a sequence of processed frames.
+
+Each output frame is the absolute difference between a frame and a model of
+the static background, so that what changes, e.g. plants growing or animals
+moving, stands out against a dark, still scene. Streaming models are updated
+one frame at a time, with memory of a single background frame. The temporal
+median model reads the frames twice, chunk by chunk: first a sample of each
+chunk to compute its median, then all frames of the chunk to subtract it.
+"""
+
+# Exponential moving average, approximate running median and chunked temporal median
+background_models = ("ema", "median", "temporal-median")
+default_background_model = "ema"
+# Weight of each new frame in the moving average
+default_alpha = 0.05
+# Largest change of the running median per frame, in intensity levels
+default_median_step = 2
+# Frames per chunk of the temporal median, and frames sampled per chunk
+default_chunk_size = 240
+default_median_samples = 25
+# Multiplier of differences, to make small changes visible
+default_gain = 1
+
+
+def temporal_median(frames):
+    """Return per-pixel median of frames. For an even number of frames the lower median"""
+    stack = np.stack(frames)
+    middle = (len(frames) - 1) // 2
+    return np.partition(stack, middle, axis=0)[middle]
+
+
+class BackgroundSubtractor:
+    """
+    Subtract a background model from frames given in chronological order.
+
+    Attributes:
+        model: One of background_models
+        alpha: Weight of each new frame in the moving average of model "ema"
+        median_step: Largest change per frame of the running median of model "median"
+        chunk_size: Frames per chunk of model "temporal-median". The background of
+            a frame is interpolated between the medians of neighbouring chunks
+        median_samples: Frames sampled per chunk for the temporal median
+        gain: Multiplier of differences
+    """
+
+    def __init__(
+        self,
+        model: str = default_background_model,
+        alpha: float = default_alpha,
+        median_step: int = default_median_step,
+        chunk_size: int = default_chunk_size,
+        median_samples: int = default_median_samples,
+        gain: float = default_gain,
+    ):
+        if model not in background_models:
+            raise ValueError(
+                f"Unknown background model '{model}'. Available models: {', '.join(background_models)}"
+            )
+        if not 0 < alpha <= 1:
+            raise ValueError(f"Alpha {alpha} outside allowed range (0, 1]")
+        self.model = model
+        self.alpha = alpha
+        self.median_step = median_step
+        self.chunk_size = chunk_size
+        self.median_samples = median_samples
+        self.gain = gain
+        self._background = None
+
+    def _difference(self, frame, background):
+        difference = cv2.absdiff(frame, background)
+        if self.gain != 1:
+            difference = cv2.convertScaleAbs(difference, alpha=self.gain)
+        return difference
+
+    # Difference to the background so far, then update background with frame
+    def apply(self, frame):
+        """Return difference of frame to a streaming background model, and update the model"""
+        if self._background is None:
+            dtype = np.float32 if self.model == "ema" else np.int16
+            self._background = frame.astype(dtype)
+
+        if self.model == "ema":
+            difference = self._difference(frame, cv2.convertScaleAbs(self._background))
+            cv2.accumulateWeighted(frame, self._background, self.alpha)
+        elif self.model == "median":
+            difference = self._difference(frame, self._background.astype(np.uint8))
+            # Step towards frame, which converges on the median of recent frames
+            self._background += np.clip(
+                frame.astype(np.int16) - self._background,
+                -self.median_step,
+                self.median_step,
+            ).astype(np.int16)
+        else:
+            raise ValueError(f"Background model '{self.model}' is not streaming")
+        return difference
+
+    def reset(self):
+        self._background = None
+
+    def warmup_start(self, first_image: int):
+        """Return index of the image to start subtracting from, so that frames from
+        first_image on are the same as when subtracting from the first image, within
+        an intensity level for streaming models"""
+        if self.model == "temporal-median":
+            # Chunk before the one of first_image, as its median is interpolated
+            return max((first_image // self.chunk_size - 1) * self.chunk_size, 0)
+        if self.model == "ema":
+            # Until the weight of the initial background is below half an intensity level
+            frames = math.ceil(math.log(0.5 / 255) / math.log(1 - self.alpha))
+        else:
+            frames = math.ceil(255 / self.median_step)
+        return max(first_image - frames, 0)
+
+    # first_image: Index of images[0] among all images, to align chunks of the temporal
+    #   median with those of a subtraction from the first image
+    def subtract(self, images, load_frames, first_image: int = 0):
+        """Yield frames of images with background subtracted.
+
+        load_frames(images) yields processed frames of a list of images in order.
+        It is called once for streaming models, and twice per chunk for the
+        temporal median"""
+        if self.model != "temporal-median":
+            self.reset()
+            for frame in load_frames(images):
+                yield self.apply(frame)
+            return
+
+        first_chunk = -(first_image % self.chunk_size)
+        chunks = [
+            images[max(i, 0) : i + self.chunk_size]
+            for i in range(first_chunk, len(images), self.chunk_size)
+        ]
+        medians = {}
+
+        # First pass over a chunk, keeping only medians still needed
+        def median(index):
+            if index not in medians:
+                chunk = chunks[index]
+                sample = chunk[:: max(len(chunk) // self.median_samples, 1)]
+                medians[index] = temporal_median(
+                    list(load_frames(sample[: self.median_samples]))
+                )
+                medians.pop(index - 2, None)
+            return medians[index]
+
+        for index, chunk in enumerate(chunks):
+            for position, frame in enumerate(load_frames(chunk)):
+                # Distance from chunk center, in chunks, towards the nearest neighbour
+                offset = (position + 0.5) / len(chunk) - 0.5
+                neighbour = index + 1 if offset > 0 else index - 1
+                background = median(index)
+                if 0 <= neighbour < len(chunks):
+                    background = cv2.addWeighted(
+                        background, 1 - abs(offset), median(neighbour), abs(offset), 0
+                    )
+                yield self._difference(frame, background)
@@ -0,0 +1,92 @@
+from collections import deque
+
+import cv2
+import numpy as np
+
+"""
+Deflickering of a sequence of processed frames.
+
+Automatic exposure makes brightness and contrast jump between frames. For each
+frame, the mean and standard deviation of its luminance are compared with the
+median over a window of frames centered on it, and a gain and offset bring the
+frame to the window median. Slow changes, such as dusk, are kept, while jumps
+between single frames are removed. Frames are delayed by half a window, which
+is the only memory used besides the statistics.
+"""
+
+default_window = 9
+# Frames are reduced to this width before computing statistics
+statistics_width = 160
+# Largest gain applied to contrast, and its inverse the smallest
+default_max_gain = 2
+
+
+def luminance_statistics(frame):
+    """Return mean and standard deviation of luminance of a BGR or gray frame"""
+    height, width = frame.shape[:2]
+    if width > statistics_width:
+        size = (statistics_width, max(round(height * statistics_width / width), 1))
+        frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+    if frame.ndim == 3:
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    mean, std = cv2.meanStdDev(frame)
+    return float(mean[0, 0]), float(std[0, 0])
+
+
+class Deflicker:
+    """
+    Correct brightness and contrast of frames towards a rolling median.
+
+    Attributes:
+        window: Number of frames, centered on each frame, of the rolling median.
+            Even numbers are rounded up
+        max_gain: Largest correction of contrast, as a factor
+    """
+
+    def __init__(
+        self, window: int = default_window, max_gain: float = default_max_gain
+    ):
+        if window < 1:
+            raise ValueError(f"Illegal deflicker window: {window} frames")
+        self.window = window
+        self.max_gain = max_gain
+
+    @property
+    def warmup_frames(self):
+        """Frames before a frame needed to correct it as in a longer sequence"""
+        return self.window // 2
+
+    # Gain and offset as a lookup table, which is faster than arithmetic on the frame
+    def _correct(self, frame, statistics, window_statistics):
+        mean, std = statistics
+        target_mean, target_std = np.median(window_statistics, axis=0)
+        gain = np.clip(
+            target_std / std if std > 0 else 1, 1 / self.max_gain, self.max_gain
+        )
+        offset = target_mean - gain * mean
+        lut = np.clip(np.arange(256) * gain + offset, 0, 255).round().astype(np.uint8)
+        return cv2.LUT(frame, lut)
+
+    def correct(self, frames):
+        """Yield frames corrected in order, each delayed by half a window"""
+        half_window = self.window // 2
+        # Frames not corrected yet, and statistics from half a window before the oldest
+        pending = deque()
+        statistics = deque()
+
+        def correct_oldest():
+            index, frame = pending.popleft()
+            window = [s for i, s in statistics if abs(i - index) <= half_window]
+            frame_statistics = statistics[index - statistics[0][0]][1]
+            while statistics and statistics[0][0] < index + 1 - half_window:
+                statistics.popleft()
+            return self._correct(frame, frame_statistics, window)
+
+        for index, frame in enumerate(frames):
+            statistics.append((index, luminance_statistics(frame)))
+            pending.append((index, frame))
+            if len(pending) > half_window:
+                yield correct_oldest()
+        # Last frames, with windows cut at the end
+        while pending:
+            yield correct_oldest()
@@ -0,0 +1,110 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+from shared.frame_archive import image_version
+
+default_cache_dir = Path(os.path.expanduser("~")) / "cache" / "frames"
+default_cache_size_gb = 10
+# Increase when processing changes, so that frames processed by older code are not used
+cache_version = 2
+
+
+class FrameCache:
+    """
+    On-disk cache of processed frames, shared between renders.
+
+    Frames are stored as .npy files, named by a hash of source image path,
+    modification time and size, and the transform parameters of the template.
+    Changing e.g. fps or skip of a template reuses all frames, while changing
+    crop or rotation misses the cache. The least recently used frames are
+    deleted when the cache exceeds max_bytes. Use order is kept in file
+    modification times, so it persists between sessions.
+
+    Attributes:
+        cache_dir: Folder holding cached frames
+        max_bytes: Largest total size of cached frames
+    """
+
+    def __init__(
+        self,
+        cache_dir: Path = default_cache_dir,
+        max_bytes: int = default_cache_size_gb * 1024**3,
+    ):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.nbr_of_hits = 0
+        self.nbr_of_misses = 0
+
+        self._lock = threading.Lock()
+        # Size of each cached frame, least recently used first
+        self._entries = OrderedDict()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        # Single scan on startup, afterwards entries are tracked in memory
+        files = [
+            (entry.stat().st_mtime, entry.path, entry.stat().st_size)
+            for folder in os.scandir(self.cache_dir)
+            if folder.is_dir()
+            for entry in os.scandir(folder.path)
+            if entry.name.endswith(".npy")
+        ]
+        for _, path, nbytes in sorted(files):
+            self._entries[path] = nbytes
+            self.total_bytes += nbytes
+
+    def key(self, image, params):
+        """Return cache key of image processed with params"""
+        description = f"{cache_version}|{image}|{image_version(image)}|{params}"
+        return hashlib.sha1(description.encode()).hexdigest()
+
+    # Frames are spread over sub folders, to keep folders small
+    def _path(self, key):
+        return str(self.cache_dir / key[:2] / f"{key}.npy")
+
+    def get(self, key):
+        """Return cached frame, or None if not in cache"""
+        path = self._path(key)
+        try:
+            frame = np.load(path)
+        except (OSError, ValueError):
+            with self._lock:
+                self.nbr_of_misses += 1
+            return None
+        # Mark as recently used, also for later sessions. The frame may have been
+        #   evicted since it was loaded, by another thread or process
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self._lock:
+            self.nbr_of_hits += 1
+            if path in self._entries:
+                self._entries.move_to_end(path)
+        return frame
+
+    def put(self, key, frame):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to temporary file first, so that readers never load a partial frame
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, frame)
+        os.replace(tmp_path, path)
+        nbytes = os.path.getsize(path)
+
+        with self._lock:
+            self.total_bytes += nbytes - self._entries.pop(path, 0)
+            self._entries[path] = nbytes
+            while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+                old_path, old_bytes = self._entries.popitem(last=False)
+                self.total_bytes -= old_bytes
+                try:
+                    os.remove(old_path)
+                except FileNotFoundError:
+                    pass
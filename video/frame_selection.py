@@ -0,0 +1,241 @@
+from datetime import date, datetime, timedelta
+from numbers import Number
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+"""
+Selection of frames by capture time, over arrays of timestamps.
+
+Capture times are local wall clock times, as in file names, handled as int64
+seconds since 1970-01-01 local time. Times of day and time steps refer to
+standard (winter) time: frames recorded during DST are shifted back by the
+DST offset before selection. The offset is looked up once per day, and on
+days when DST starts or ends, the time of change is found by bisection.
+"""
+
+default_timezone = "Europe/Oslo"
+seconds_per_day = 24 * 3600
+_epoch = datetime(1970, 1, 1)
+
+
+def parse_date(date_str: str):
+    """Return datetime of a string formatted YYYY-mm-DD-HH-MM-SS, as in file names,
+    where trailing fields may be left out. Dates, e.g. parsed by YAML, are also accepted"""
+    if isinstance(date_str, datetime):
+        return date_str
+    if isinstance(date_str, date):
+        return datetime(date_str.year, date_str.month, date_str.day)
+    fields = date_str.split("-")
+    fields += ["00"] * (6 - len(fields))
+    return datetime.strptime("-".join(fields), "%Y-%m-%d-%H-%M-%S")
+
+
+def time_of_day_seconds(time_str: str):
+    """Return seconds after midnight of a time formatted HH:MM, up to 24:00"""
+    hours, minutes = (int(x) for x in time_str.split(":"))
+    seconds = hours * 3600 + minutes * 60
+    if not 0 <= seconds <= seconds_per_day:
+        raise ValueError(f"Time of day {time_str} outside 00:00-24:00")
+    return seconds
+
+
+def to_seconds(dates):
+    """Return int64 seconds of datetimes, or of an array of numpy.datetime64"""
+    return np.asarray(dates, dtype="datetime64[s]").astype(np.int64)
+
+
+def _dst_seconds(seconds: int, tz: ZoneInfo):
+    date = (_epoch + timedelta(seconds=int(seconds))).replace(tzinfo=tz)
+    return int(date.dst().total_seconds())
+
+
+# First second of the day from which the DST offset is end_dst
+def _dst_change(day_start: int, end_dst: int, tz: ZoneInfo):
+    low, high = day_start, day_start + seconds_per_day - 1
+    while low < high:
+        middle = (low + high) // 2
+        if _dst_seconds(middle, tz) == end_dst:
+            high = middle
+        else:
+            low = middle + 1
+    return low
+
+
+# Index of first frame of each day, for sorted times
+def _day_starts(seconds):
+    days = seconds // seconds_per_day
+    return np.flatnonzero(np.diff(days, prepend=days[0] - 1))
+
+
+def standard_time(seconds, timezone: str = default_timezone):
+    """Return sorted local times in seconds shifted back by the DST offset in effect"""
+    if len(seconds) == 0:
+        return seconds
+    tz = ZoneInfo(timezone)
+    day_first = _day_starts(seconds)
+    day_starts = seconds[day_first] // seconds_per_day * seconds_per_day
+    start_dst = np.array([_dst_seconds(s, tz) for s in day_starts])
+    end_dst = np.array([_dst_seconds(s + seconds_per_day - 1, tz) for s in day_starts])
+
+    offsets = np.repeat(start_dst, np.diff(day_first, append=len(seconds)))
+    # DST starts or ends during these days
+    for day in np.flatnonzero(start_dst != end_dst):
+        first = day_first[day]
+        last = day_first[day + 1] if day + 1 < len(day_first) else len(seconds)
+        change = _dst_change(int(day_starts[day]), int(end_dst[day]), tz)
+        offsets[first:last] = np.where(
+            seconds[first:last] < change, start_dst[day], end_dst[day]
+        )
+    return seconds - offsets
+
+
+# Index of frame closest to each target, or -1 if none within max_distance.
+#   If same_day, only frames of the same day as the target are considered
+def _nearest(seconds, targets, same_day: bool = False, max_distance=np.inf):
+    right = np.searchsorted(seconds, targets)
+    left = right - 1
+    left_valid = left >= 0
+    right_valid = right < len(seconds)
+    left_clipped = np.maximum(left, 0)
+    right_clipped = np.minimum(right, len(seconds) - 1)
+    if same_day:
+        target_days = targets // seconds_per_day
+        left_valid &= seconds[left_clipped] // seconds_per_day == target_days
+        right_valid &= seconds[right_clipped] // seconds_per_day == target_days
+    left_distance = np.where(left_valid, targets - seconds[left_clipped], np.inf)
+    right_distance = np.where(right_valid, seconds[right_clipped] - targets, np.inf)
+    # Earlier frame wins ties
+    nearest = np.where(left_distance <= right_distance, left, right)
+    distance = np.minimum(left_distance, right_distance)
+    return np.where(distance <= max_distance, nearest, -1)
+
+
+def select_per_day(seconds, times_of_day):
+    """Return indices of the frames closest to each time of day, in seconds,
+    on each day with frames, for sorted times"""
+    if len(seconds) == 0:
+        return np.array([], dtype=np.int64)
+    days = seconds[_day_starts(seconds)] // seconds_per_day
+    targets = (
+        days[:, np.newaxis] * seconds_per_day + np.asarray(times_of_day)[np.newaxis, :]
+    ).ravel()
+    nearest = _nearest(seconds, targets.astype(np.int64), same_day=True)
+    return np.unique(nearest[nearest >= 0])
+
+
+def select_every(seconds, step_s: Number):
+    """Return indices of the frames closest to a constant time step, aligned to
+    midnight, for sorted times. Steps without a frame within half a step are skipped"""
+    if len(seconds) == 0:
+        return np.array([], dtype=np.int64)
+    first = seconds[0] - seconds[0] % seconds_per_day
+    first += (seconds[0] - first) // step_s * step_s
+    targets = np.arange(first, seconds[-1] + step_s, step_s)
+    nearest = _nearest(seconds, targets, max_distance=step_s / 2)
+    return np.unique(nearest[nearest >= 0])
+
+
+class FrameSelection:
+    """
+    Selection of frames by capture time.
+
+    Frames are limited to those captured from start until end. Then at most
+    one strategy applies: daily_time selects the frame closest to a time of
+    day on each day, per_day selects the frames closest to per_day evenly
+    spaced times of each day, and every_minutes resamples to a constant time
+    step.
+
+    Attributes:
+        start: Optional datetime of first frame
+        end: Optional datetime after last frame
+        daily_time: Time of day formatted HH:MM, in standard (winter) time
+        per_day: Number of frames per day
+        every_minutes: Time step in minutes
+        timezone: Timezone for DST conversion
+    """
+
+    def __init__(
+        self,
+        start: datetime = None,
+        end: datetime = None,
+        daily_time: str = None,
+        per_day: int = None,
+        every_minutes: Number = None,
+        timezone: str = default_timezone,
+    ):
+        strategies = [s for s in (daily_time, per_day, every_minutes) if s is not None]
+        if len(strategies) > 1:
+            raise ValueError(
+                "Only one of daily time, frames per day and time step can be given"
+            )
+        if per_day is not None and per_day < 1:
+            raise ValueError(f"Illegal number of frames per day: {per_day}")
+        if every_minutes is not None and every_minutes <= 0:
+            raise ValueError(f"Illegal time step: {every_minutes} minutes")
+        self.start = start
+        self.end = end
+        self.daily_time = daily_time
+        self.per_day = per_day
+        self.every_minutes = every_minutes
+        self.timezone = timezone
+        self._has_strategy = bool(strategies)
+        # Validate time before any frames are read
+        self._daily_seconds = (
+            time_of_day_seconds(daily_time) if daily_time is not None else None
+        )
+
+    def __str__(self):
+        if self.daily_time is not None:
+            strategy = f"daily frames at {self.daily_time}"
+        elif self.per_day is not None:
+            strategy = f"{self.per_day} frames per day"
+        elif self.every_minutes is not None:
+            strategy = f"frames every {self.every_minutes} minutes"
+        else:
+            return "all frames"
+        return f"{strategy} ({self.timezone} standard time)"
+
+    def select_indices(self, dates):
+        """Return indices of selected frames in chronological order, given capture
+        times as datetimes or numpy.datetime64"""
+        seconds = to_seconds(dates)
+        indices = np.arange(len(seconds))
+        if self.start is not None or self.end is not None:
+            in_range = np.ones(len(seconds), dtype=bool)
+            if self.start is not None:
+                in_range &= seconds >= to_seconds(self.start)
+            if self.end is not None:
+                in_range &= seconds < to_seconds(self.end)
+            indices = indices[in_range]
+            seconds = seconds[in_range]
+
+        if np.any(np.diff(seconds) < 0):
+            order = np.argsort(seconds, kind="stable")
+            indices = indices[order]
+            seconds = seconds[order]
+
+        if not self._has_strategy:
+            return indices
+
+        seconds = standard_time(seconds, self.timezone)
+        # Shifted times are chronological, unless file names repeat an hour when DST ends
+        if np.any(np.diff(seconds) < 0):
+            order = np.argsort(seconds, kind="stable")
+            indices = indices[order]
+            seconds = seconds[order]
+        if self.daily_time is not None:
+            selected = select_per_day(seconds, [self._daily_seconds])
+        elif self.per_day is not None:
+            # Centered in equal parts of the day
+            times_of_day = (
+                (np.arange(self.per_day) + 0.5) * seconds_per_day / self.per_day
+            )
+            selected = select_per_day(seconds, times_of_day)
+        else:
+            selected = select_every(seconds, self.every_minutes * 60)
+        return indices[selected]
+
+    def select(self, images, dates):
+        """Return selected images in chronological order"""
+        return [images[i] for i in self.select_indices(dates)]
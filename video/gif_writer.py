@@ -1,36 +1,152 @@
-from dataclasses import dataclass
+import cv2
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from numbers import Number
 from pathlib import Path
 
+import numpy as np
+from PIL import GifImagePlugin, Image
+
+default_colors = 32
+# Frames used for the palette, when no sample is given up front
+palette_sample_size = 16
+# Sampled frames are reduced to this width before computing the palette
+palette_sample_width = 160
+# Frames quantized ahead of writing per worker, bounding memory use
+frames_ahead_per_worker = 2
+
+
+def build_palette(frames, colors: int = default_colors):
+    """Return palette image with colors computed from a sample of BGR frames"""
+    height, width = frames[0].shape[:2]
+    size = (
+        min(width, palette_sample_width),
+        max(round(height * min(width, palette_sample_width) / width), 1),
+    )
+    mosaic = np.vstack(
+        [cv2.resize(frame, size, interpolation=cv2.INTER_AREA) for frame in frames]
+    )
+    rgb_mosaic = cv2.cvtColor(mosaic, cv2.COLOR_BGR2RGB)
+    return Image.fromarray(rgb_mosaic).quantize(
+        colors=colors, method=Image.Quantize.MEDIANCUT
+    )
+
 
-@dataclass
 class GIF_Writer:
-    video_path: Path
-    fps: Number
-    output_resolution: tuple[int, int] = None
-    frames: list = None
+    """
+    Write an animated GIF frame by frame, with memory use independent of the
+    number of frames.
 
-    def __post_init__(self):
-        if self.frames is None:
-            self.frames = []
+    All frames are quantized to one global palette, computed from
+    palette_frames if given, e.g. frames sampled across the whole video.
+    Otherwise the palette is computed from the first palette_sample_size
+    frames, which are held until then. Each frame is then quantized, encoded
+    and appended to the file, optionally in several threads.
 
-    def write(self, frame):
-        if self.output_resolution:
+    Attributes:
+        video_path: Path to GIF file
+        fps: Frames per second
+        output_resolution: Frames are resized to this resolution if given
+        colors: Number of colors in palette, at most 256
+        palette_frames: Optional BGR frames used to compute the palette
+        workers: Number of threads quantizing and encoding frames
+        dither: If True, use Floyd-Steinberg dithering
+    """
+
+    def __init__(
+        self,
+        video_path: Path,
+        fps: Number,
+        output_resolution: tuple[int, int] = None,
+        colors: int = default_colors,
+        palette_frames: list = None,
+        workers: int = 1,
+        dither: bool = False,
+    ):
+        self.video_path = video_path
+        self.fps = fps
+        self.output_resolution = output_resolution
+        self.colors = colors
+        self.workers = workers
+        self.dither = Image.Dither.FLOYDSTEINBERG if dither else Image.Dither.NONE
+        self.duration_ms = int(1000 / fps)
+        self.nbr_of_frames = 0
+
+        self._file = None
+        self._palette = None
+        self._buffer = []
+        self._pending = deque()
+        self._executor = (
+            ThreadPoolExecutor(max_workers=workers, thread_name_prefix="gif")
+            if workers > 1
+            else None
+        )
+        if palette_frames:
+            self._start([self._resize(frame) for frame in palette_frames])
+
+    def _resize(self, frame):
+        if self.output_resolution and tuple(frame.shape[1::-1]) != tuple(
+            self.output_resolution
+        ):
             frame = cv2.resize(frame, self.output_resolution)
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        pil_frame = Image.fromarray(rgb_frame)
-        self.frames.append(pil_frame)
+        return frame
+
+    def write(self, frame):
+        frame = self._resize(frame)
+        if self._palette is None:
+            self._buffer.append(frame)
+            if len(self._buffer) >= palette_sample_size:
+                self._start(self._buffer)
+            return
+        self._submit(frame)
 
     def release(self):
-        duration_ms = int(1000 / self.fps)
-        print("Writing video, stand by ...", end=" ")
-        self.frames[0].save(
-            self.video_path,
-            save_all=True,
-            append_images=self.frames[1:],
-            duration=duration_ms,
-            loop=0,
-            optimize=True,
-            colors=32,
+        if self._palette is None:
+            if not self._buffer:
+                return
+            self._start(self._buffer)
+        while self._pending:
+            self._write_data(self._pending.popleft().result())
+        if self._executor is not None:
+            self._executor.shutdown()
+        self._file.write(b";")
+        self._file.close()
+        print(f"Wrote {self.nbr_of_frames} frames to {self.video_path}")
+
+    # Compute palette, write file header and frames held so far
+    def _start(self, sample_frames):
+        self._palette = build_palette(sample_frames, self.colors)
+        # Header holds canvas size and global palette
+        height, width = sample_frames[0].shape[:2]
+        canvas = Image.new("P", (width, height))
+        canvas.putpalette(self._palette.getpalette())
+        header, _ = GifImagePlugin.getheader(
+            canvas,
+            info={"loop": 0, "duration": self.duration_ms, "optimize": False},
         )
-        print("Done")
+        self._file = open(self.video_path, "wb")
+        for block in header:
+            self._file.write(block)
+        buffer, self._buffer = self._buffer, []
+        for frame in buffer:
+            self._submit(frame)
+
+    def _submit(self, frame):
+        if self._executor is None:
+            self._write_data(self._encode(frame))
+            return
+        self._pending.append(self._executor.submit(self._encode, frame))
+        while len(self._pending) > self.workers * frames_ahead_per_worker:
+            self._write_data(self._pending.popleft().result())
+
+    # Quantize to global palette and encode, without a local color table
+    def _encode(self, frame):
+        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        pil_frame = Image.fromarray(rgb_frame).quantize(
+            palette=self._palette, dither=self.dither
+        )
+        return b"".join(GifImagePlugin.getdata(pil_frame, duration=self.duration_ms))
+
+    def _write_data(self, data):
+        self._file.write(data)
+        self.nbr_of_frames += 1
@@ -1,6 +1,19 @@
 from .video_settings_parser import parse_video_settings
+from .video_template import OutputSpec
 
 
-def make_video(video_tag: str, video_path: str, preview: bool):
+# outputs: Further videos rendered from the same decoded frames
+def make_video(
+    video_tag: str,
+    video_path: str,
+    preview: bool,
+    incremental: bool = False,
+    outputs: list[OutputSpec] = None,
+):
     template = parse_video_settings(video_tag)
-    template.render_video(video_path=video_path, preview=preview)
+    template.render_video(
+        video_path=video_path,
+        preview=preview,
+        incremental=incremental,
+        outputs=outputs,
+    )
@@ -0,0 +1,151 @@
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+from pathlib import Path
+
+"""
+Manifest of an incrementally rendered video.
+
+The video is rendered as segments in <video>.segments/, each holding frames
+added since the previous render, and concatenated into <video> by ffmpeg
+without re-encoding. The manifest <video>.manifest.json records the render
+parameters, the images rendered so far and the segments.
+"""
+
+manifest_version = 1
+
+
+def images_digest(images):
+    """Return hash of a list of images, to detect changes to already rendered images"""
+    digest = hashlib.sha1()
+    for image in images:
+        digest.update(str(image).encode())
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+
+def require_ffmpeg():
+    """Raise FileNotFoundError if ffmpeg, which concatenates segments, is not installed"""
+    if shutil.which("ffmpeg") is None:
+        raise FileNotFoundError("ffmpeg is required to concatenate video segments")
+
+
+class RenderManifest:
+    """
+    Attributes:
+        video_path: Path to rendered video
+        params: Render parameters. Segments rendered with other parameters are discarded
+        nbr_of_images: Number of images rendered so far
+        digest: Hash of images rendered so far
+        segments: File names of segments, in order
+    """
+
+    def __init__(self, video_path: Path, params):
+        self.video_path = Path(video_path)
+        self.params = params
+        self.nbr_of_images = 0
+        self.digest = images_digest([])
+        self.segments = []
+
+    @property
+    def manifest_path(self):
+        return Path(f"{self.video_path}.manifest.json")
+
+    @property
+    def segments_dir(self):
+        return Path(f"{self.video_path}.segments")
+
+    # Parameters are compared after a round trip through JSON, which turns tuples into lists
+    @classmethod
+    def load(cls, video_path: Path, params):
+        """Return manifest of video, or an empty one if missing or rendered with other parameters"""
+        manifest = cls(video_path, params)
+        if not manifest.manifest_path.is_file():
+            return manifest
+        with open(manifest.manifest_path) as f:
+            data = json.load(f)
+        if data.get("version") != manifest_version or data.get("params") != json.loads(
+            json.dumps(params)
+        ):
+            print("Render parameters changed, rendering all images")
+            return manifest
+        if not all((manifest.segments_dir / s).is_file() for s in data["segments"]):
+            print("Segments missing, rendering all images")
+            return manifest
+        manifest.nbr_of_images = data["nbr_of_images"]
+        manifest.digest = data["digest"]
+        manifest.segments = data["segments"]
+        return manifest
+
+    def save(self):
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {
+                    "version": manifest_version,
+                    "params": self.params,
+                    "nbr_of_images": self.nbr_of_images,
+                    "digest": self.digest,
+                    "segments": self.segments,
+                },
+                f,
+                indent=2,
+            )
+        os.replace(tmp_path, self.manifest_path)
+
+    def new_images(self, images):
+        """Return images not rendered yet. All images are new if rendered images have changed"""
+        if (
+            self.nbr_of_images > len(images)
+            or images_digest(images[: self.nbr_of_images]) != self.digest
+        ):
+            if self.segments:
+                print("Rendered images changed, rendering all images")
+            self.clear()
+        return images[self.nbr_of_images :]
+
+    def clear(self):
+        if self.segments_dir.is_dir():
+            shutil.rmtree(self.segments_dir)
+        self.nbr_of_images = 0
+        self.digest = images_digest([])
+        self.segments = []
+
+    def next_segment_path(self):
+        os.makedirs(self.segments_dir, exist_ok=True)
+        return self.segments_dir / f"segment-{len(self.segments):04d}{self.video_path.suffix}"
+
+    def add_segment(self, segment_path: Path, images):
+        self.segments.append(Path(segment_path).name)
+        self.nbr_of_images = len(images)
+        self.digest = images_digest(images)
+
+    def concat_segments(self):
+        """Write video from all segments without re-encoding"""
+        require_ffmpeg()
+        list_path = self.segments_dir / "segments.txt"
+        with open(list_path, "w") as f:
+            for segment in self.segments:
+                f.write(f"file '{(self.segments_dir / segment).resolve()}'\n")
+        tmp_path = self.video_path.with_name(f"tmp-{self.video_path.name}")
+        subprocess.run(
+            [
+                "ffmpeg",
+                "-y",
+                "-loglevel",
+                "error",
+                "-f",
+                "concat",
+                "-safe",
+                "0",
+                "-i",
+                str(list_path),
+                "-c",
+                "copy",
+                str(tmp_path),
+            ],
+            check=True,
+        )
+        os.replace(tmp_path, self.video_path)
@@ -2,13 +2,14 @@ from dataclasses import dataclass, fields
 from pathlib import Path
 import os
 import yaml
-from glob import glob
 import numpy as np
 from numbers import Number
-import cv2
-import re
 
-from .video_template import VideoTemplate
+from shared.frame_archive import read_image
+from shared.frame_index import FrameIndex
+from .frame_cache import FrameCache
+from .frame_selection import FrameSelection, default_timezone, parse_date
+from .video_template import VideoTemplate, default_workers
 
 
 @dataclass
@@ -25,6 +26,16 @@ class VideoSettingsParser:
     skip: int = None
     # Start at date and time given by string (formatted YY-mm-DD-HH-MM-SS)
     startat: str = None
+    # End before date and time given by string (formatted YY-mm-DD-HH-MM-SS)
+    endat: str = None
+    # Use one frame per day, closest to time given by string (formatted HH:MM, standard time)
+    daily: str = None
+    # Use n frames per day, closest to evenly spaced times of day
+    per_day: int = None
+    # Use frames closest to a constant time step in minutes
+    every: Number = None
+    # Timezone for DST conversion of daily, per_day and every
+    timezone: str = None
     # Set resolution
     resolution: tuple[Number, Number] = None
     # Resolution of final movie
@@ -37,8 +48,14 @@ class VideoSettingsParser:
     gray: int = None
     # Histogram normalization (0 or 1)
     normalize: int = None
-    # Subtract background (0 or 1)
-    subtract: int = None
+    # Deflicker window in frames (0 to disable)
+    deflicker: int = None
+    # Subtract background (0 or 1, or model: ema, median or temporal-median)
+    subtract: int | str = None
+    # Number of threads processing frames (default number of CPU cores)
+    workers: int = None
+    # Cache processed frames on disk for later renders (0 or 1)
+    cache: int = None
     # # Thresholding values for filtering - 0, 1, 2, 3 or 6 element vector
     # threshold : Number | np.array = None
 
@@ -47,20 +64,21 @@ class VideoSettingsParser:
 
         top_dir = top_dir or Path(os.path.expanduser("~")) / "data"
 
-        pattern = str(top_dir / self.dir / "*.png")
-        images = sorted(glob(pattern))
-
-        if self.startat:
-            while len(self.startat.split("-")) < 5:
-                self.startat += "-00"
-            images = [
-                i
-                for i in images
-                if re.search(
-                    r"(\d{4}-\d{2}-\d{2}-\d{2}-\d{2}-\d{2})", os.path.basename(i)
-                ).group(1)
-                >= self.startat
-            ]
+        selection = FrameSelection(
+            start=parse_date(self.startat) if self.startat else None,
+            end=parse_date(self.endat) if self.endat else None,
+            daily_time=self.daily,
+            per_day=self.per_day,
+            every_minutes=self.every,
+            timezone=self.timezone or default_timezone,
+        )
+
+        # Frames are listed from the index of the folder, updated with new files first
+        with FrameIndex(top_dir / self.dir) as index:
+            index.refresh()
+            images, dates = index.frame_times(selection.start, selection.end)
+            images = selection.select(images, dates)
+            first_resolution = index.resolution(images[0]) if images else None
 
         if self.skip:
             images = images[:: self.skip]
@@ -72,12 +90,15 @@ class VideoSettingsParser:
         output_resolution = self.output_resolution
         grayscale = self.gray
         normalize = self.normalize
+        deflicker = self.deflicker
         subtract_background = self.subtract
         # threshold = self.threshold
 
         input_resolution_fixed = input_resolution is not None
         if not input_resolution_fixed:
-            input_resolution = cv2.imread(images[0]).shape[:2][::-1]
+            input_resolution = (
+                first_resolution or read_image(images[0]).shape[:2][::-1]
+            )
 
         if not output_resolution:
             if crop:
@@ -113,10 +134,13 @@ class VideoSettingsParser:
             rotation=rotation,
             grayscale=grayscale,
             normalize=normalize,
+            deflicker=deflicker,
             subtract_background=subtract_background,
             #        lower_threshold=lower_threshold,
             #        upper_threshold=upper_threshold,
             output_resolution=output_resolution,
+            workers=self.workers or default_workers,
+            frame_cache=FrameCache() if self.cache else None,
         )
 
 
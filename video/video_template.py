@@ -1,20 +1,83 @@
 from pathlib import Path
 from tqdm import tqdm
+import os
 import cv2
+import numpy as np
+from collections import deque
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
 from functools import cached_property
-from datetime import datetime
-import re
+from itertools import islice
 
-from .gif_writer import GIF_Writer
+from shared.image_files import (
+    filename_to_date,
+    reduced_image_path,
+    reduction_factors,
+)
+from shared.frame_archive import image_exists, read_image
+from .background_subtraction import BackgroundSubtractor, default_background_model
+from .deflicker import Deflicker
+from .frame_cache import FrameCache
+from .gif_writer import GIF_Writer, palette_sample_size
+from .render_manifest import RenderManifest, require_ffmpeg
 
+# Threads decoding and transforming frames. OpenCV releases the GIL, so threads run in parallel
+default_workers = os.cpu_count() or 1
+# Frames processed ahead of the consumer per worker, bounding memory use
+frames_ahead_per_worker = 2
+# Codec of rendered videos
+fourcc_code = "mp4v"
+# Formats decoded at reduced resolution by the codec itself, when no thumbnail is stored.
+#   For other formats OpenCV decodes the full image before reducing it, which gains nothing
+reduced_decode_extensions = (".jpg", ".jpeg")
+reduced_decode_flags = {
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
 
-def filename_to_date(filename):
-    pattern = r"(\d{4}-\d{2}-\d{2}-\d{2}-\d{2}-\d{2})"
-    match = re.search(pattern, filename)
-    if match:
-        date_str = match.group(1)
-        return datetime.strptime(date_str, "%Y-%m-%d-%H-%M-%S")
-    raise Exception(f"Cannot parse date from file name: {filename}")
+
+# Affine maps as 3x3 matrices, with pixel centers at integer coordinates as in OpenCV
+def scaling(scale_x, scale_y):
+    return np.array(
+        [
+            [scale_x, 0, (scale_x - 1) / 2],
+            [0, scale_y, (scale_y - 1) / 2],
+            [0, 0, 1],
+        ]
+    )
+
+
+def translation(offset_x, offset_y):
+    return np.array([[1, 0, offset_x], [0, 1, offset_y], [0, 0, 1]])
+
+
+@dataclass
+class OutputSpec:
+    """
+    Video rendered from a template. Unset fields default to those of the template.
+
+    Attributes:
+        video_path: Path to video, a GIF if ending with .gif
+        output_resolution: Resolution of video
+        fps: Frames per second
+        codec: FourCC code of video, ignored for GIF
+    """
+
+    video_path: Path
+    output_resolution: tuple[int, int] = None
+    fps: float = None
+    codec: str = None
+
+
+# Output being rendered: file written, index of first image written, and
+#   manifest when rendering a segment of an incremental video
+@dataclass
+class _RenderJob:
+    spec: OutputSpec
+    path: Path
+    first_image: int = 0
+    manifest: RenderManifest = None
 
 
 class VideoTemplate:
@@ -31,8 +94,19 @@ class VideoTemplate:
         crop: Cropping bounds as (left, top, right, bottom), applied after rotation
         grayscale: If True, convert frames to grayscale
         normalize: If True, apply histogram equalization
-        subtract_background: If True, subtract background from frames
+        deflicker: Window in frames of deflickering, see video.deflicker. None or
+            0 disables deflickering. Applied in order after frames are processed
+        subtract_background: If True or the name of a background model, see
+            video.background_subtraction, show the difference of each frame to
+            the background. Applied in order after frames are processed and cached
         output_resolution: Target resolution for rendered video
+        use_thumbnails: If True, decode the smallest stored thumbnail that still
+            resolves output_resolution, instead of the full image. Without
+            thumbnails, JPEG images are decoded at the same reduced resolution
+        workers: Number of threads processing frames. Frames are still yielded
+            in order. 1 processes frames in the calling thread
+        frame_cache: Optional on-disk cache of processed frames, reused when
+            rendering again with the same geometry
     """
 
     def __init__(
@@ -45,8 +119,12 @@ class VideoTemplate:
         crop: tuple[int, int, int, int] = None,
         grayscale: bool = False,
         normalize: bool = False,
-        subtract_background: bool = False,
+        deflicker: int = None,
+        subtract_background: bool | str = False,
         output_resolution: tuple[int, int] = None,
+        use_thumbnails: bool = True,
+        workers: int = default_workers,
+        frame_cache: FrameCache = None,
     ):
 
         self.images = images
@@ -57,8 +135,12 @@ class VideoTemplate:
         self.crop = crop
         self.grayscale = grayscale
         self.normalize = normalize
+        self.deflicker = deflicker
         self.subtract_background = subtract_background
         self.output_resolution = output_resolution
+        self.use_thumbnails = use_thumbnails
+        self.workers = workers
+        self.frame_cache = frame_cache
 
     # # Lower threshold for object detection filtering
     # lower_threshold : Number | np.array = None
@@ -67,21 +149,33 @@ class VideoTemplate:
     # upper_threshold : Number | np.array = None
 
     def _clear_cache(self):
-        for attr in ("_rotation_matrix", "_rotation_frame_dim"):
-            if hasattr(self, attr):
-                delattr(self, attr)
+        for attr in (
+            "_rotation_matrix",
+            "_rotation_frame_dim",
+            "_source_frame_dim",
+            "_thumbnail_factor",
+            "_affine_transform",
+            "_frame_transforms",
+        ):
+            # hasattr would compute the cached property, e.g. decoding the first image
+            self.__dict__.pop(attr, None)
 
     def __setattr__(self, name, value):
-        if name in ("rotation", "images"):
+        if name in (
+            "rotation",
+            "images",
+            "crop",
+            "input_resolution",
+            "output_resolution",
+            "use_thumbnails",
+        ):
             self._clear_cache()
         super().__setattr__(name, value)
 
     @cached_property
     def _rotation_frame_dim(self):
         if self.rotation is not None:
-            frame = cv2.imread(self.images[0])
-            height, width = frame.shape[:2]
-            return width, height
+            return self._source_frame_dim
         return None
 
     @cached_property
@@ -92,73 +186,425 @@ class VideoTemplate:
             return cv2.getRotationMatrix2D(center, self.rotation, 1.0)
         return None
 
-    def process_frames(self, ts=False):
-        """Iterator that yields processed frames one by one"""
-        for image in self.images:
-            frame = cv2.imread(image)
+    @cached_property
+    def _source_frame_dim(self):
+        frame = read_image(self.images[0])
+        height, width = frame.shape[:2]
+        return width, height
 
-            if not self.input_resolution_fixed and list(frame.shape[:2]) != list(
-                self.input_resolution[::-1]
-            ):
-                raise Exception(
-                    f"Inconsistent pre cropped resolution: {frame.shape[:2]} vs {self.input_resolution[::-1]}"
-                )
+    # Frames of other sizes than the first image are read in full, see _read_frame
+    @cached_property
+    def _thumbnail_factor(self):
+        """Largest thumbnail factor with at least one source pixel per output pixel"""
+        if not self.use_thumbnails or not self.output_resolution:
+            return 1
+        source_width, source_height = self._source_frame_dim
+        input_width, input_height = self.input_resolution or self._source_frame_dim
+        if self.crop is not None:
+            left_crop, top_crop, right_crop, bottom_crop = self.crop
+            crop_width, crop_height = right_crop - left_crop, bottom_crop - top_crop
+        else:
+            crop_width, crop_height = input_width, input_height
+        output_width, output_height = self.output_resolution
 
-            if self.input_resolution is not None:
-                frame = cv2.resize(frame, self.input_resolution)
+        max_factor = min(
+            source_width / input_width * crop_width / output_width,
+            source_height / input_height * crop_height / output_height,
+        )
+        return max([1] + [f for f in reduction_factors if f <= max_factor])
 
-            if self.rotation is not None and self.rotation != 0:
-                frame = cv2.warpAffine(
-                    frame, self._rotation_matrix, self._rotation_frame_dim
-                )
+    @cached_property
+    def _affine_transform(self):
+        """Map from pixels of the first image to output pixels, and the output size"""
+        return self._geometry(self._source_frame_dim)
 
-            if self.crop is not None:
-                left_crop, top_crop, right_crop, bottom_crop = self.crop
-                frame = frame[top_crop:bottom_crop, left_crop:right_crop]
+    # Transforms by frame size and reduction factor, as source frames may differ in size
+    @cached_property
+    def _frame_transforms(self):
+        return {}
 
-            if self.output_resolution:
-                frame = cv2.resize(frame, self.output_resolution)
+    def _geometry(self, source_dim):
+        """Map from source pixels to output pixels as a 3x3 matrix, combining input
+        resolution, rotation, crop and output resolution, and the output size"""
+        transform = np.eye(3)
+        width, height = source_dim
 
-            if list(frame.shape[:2]) != list(self.output_resolution[::-1]):
-                raise Exception(
-                    f"Inconsistent cropped resolution: {frame.shape[:2]} vs {self.output_resolution[::-1]:}"
-                )
+        if self.input_resolution is not None:
+            input_width, input_height = self.input_resolution
+            transform = scaling(input_width / width, input_height / height) @ transform
+            width, height = input_width, input_height
 
-            if self.grayscale:
-                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-                frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+        if self.rotation is not None and self.rotation != 0:
+            transform = np.vstack([self._rotation_matrix, [0, 0, 1]]) @ transform
+            width, height = self._rotation_frame_dim
+
+        if self.crop is not None:
+            left_crop, top_crop, right_crop, bottom_crop = self.crop
+            transform = translation(-left_crop, -top_crop) @ transform
+            width, height = right_crop - left_crop, bottom_crop - top_crop
+
+        if self.output_resolution:
+            output_width, output_height = self.output_resolution
+            transform = scaling(output_width / width, output_height / height) @ transform
+            width, height = output_width, output_height
+
+        return transform, (width, height)
+
+    # Whether frame, reduced by factor, has the size of the first image
+    def _matches_source(self, frame, factor):
+        height, width = frame.shape[:2]
+        return all(
+            abs(x - source / factor) < 1
+            for x, source in zip((width, height), self._source_frame_dim)
+        )
+
+    def _frame_transform(self, frame, factor):
+        height, width = frame.shape[:2]
+        key = (width, height, factor)
+        if key not in self._frame_transforms:
+            if self._matches_source(frame, factor):
+                transform, size = self._affine_transform
+            else:
+                # Input resolution rectifies frames of any size
+                transform, size = self._geometry((width * factor, height * factor))
+            if factor > 1:
+                # Thumbnail pixels to source pixels
+                transform = transform @ scaling(factor, factor)
+            self._frame_transforms[key] = transform, size
+        return self._frame_transforms[key]
+
+    # Resample frame once, instead of once per step of the geometry
+    def _transform_frame(self, frame, factor):
+        transform, size = self._frame_transform(frame, factor)
+        if np.allclose(transform, np.eye(3)):
+            return frame
+
+        # Without rotation, a region of whole pixels is resized, which is faster than warpAffine
+        scale_x, shear_x, offset_x = transform[0]
+        shear_y, scale_y, offset_y = transform[1]
+        if shear_x == 0 and shear_y == 0:
+            left = (-0.5 - offset_x) / scale_x + 0.5
+            top = (-0.5 - offset_y) / scale_y + 0.5
+            right = left + size[0] / scale_x
+            bottom = top + size[1] / scale_y
+            bounds = np.array([left, top, right, bottom])
+            height, width = frame.shape[:2]
+            if (
+                np.allclose(bounds, np.round(bounds))
+                and left >= -0.01
+                and top >= -0.01
+                and right <= width + 0.01
+                and bottom <= height + 0.01
+            ):
+                left, top, right, bottom = np.round(bounds).astype(int)
+                frame = frame[top:bottom, left:right]
+                if (right - left, bottom - top) != tuple(size):
+                    frame = cv2.resize(frame, size)
+                return frame
+
+        return cv2.warpAffine(frame, transform[:2], size)
+
+    # Read thumbnail if available, otherwise image at reduced or full resolution.
+    #   Returns frame and its reduction factor
+    def _read_frame(self, image):
+        factor = self._thumbnail_factor
+        if factor > 1:
+            frame = None
+            thumbnail = reduced_image_path(image, factor)
+            if image_exists(thumbnail):
+                frame = read_image(thumbnail)
+            elif str(image).lower().endswith(reduced_decode_extensions):
+                frame = read_image(image, reduced_decode_flags[factor])
+            # Factor is chosen for the size of the first image, and may be too large for others
+            if frame is not None and self._matches_source(frame, factor):
+                return frame, factor
+        return read_image(image), 1
 
-            if self.normalize:
-                if len(frame.shape) == 3:
-                    for i in range(frame.shape[2]):
-                        frame[:, :, i] = cv2.equalizeHist(frame[:, :, i])
-                else:
-                    frame = cv2.equalizeHist(frame)
-                    frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+    # first_image: Index of images[0] among all images, see BackgroundSubtractor.subtract
+    def process_frames(self, ts=False, images=None, first_image: int = 0):
+        """Iterator that yields processed frames one by one, of all images or the given subset"""
+        images = self.images if images is None else images
+        if self.subtract_background:
+            frames = self._background_subtractor().subtract(
+                images, self._deflickered_frames, first_image=first_image
+            )
+        else:
+            frames = self._deflickered_frames(images)
 
+        for image, frame in zip(images, frames):
             if ts:
                 retval = (frame, filename_to_date(image))
             else:
                 retval = frame
             yield retval
 
-    def render_video(self, video_path: Path, preview: bool):
+    # Processed frames of images in order, in several threads if more than one worker
+    def _load_frames(self, images):
+        if self.workers and self.workers > 1:
+            return self._process_frames_parallel(images)
+        return map(self._load_frame, images)
 
-        if str(video_path).endswith(".gif"):
-            writer = GIF_Writer(video_path, self.fps, self.output_resolution)
-        else:
-            fourcc = cv2.VideoWriter_fourcc(*"mp4v")
-            # fourcc = cv2.VideoWriter_fourcc(*'H264')
-            writer = cv2.VideoWriter(
-                video_path, fourcc, self.fps, self.output_resolution
+    # Brightness of each frame corrected towards that of neighbouring frames
+    def _deflickered_frames(self, images):
+        frames = self._load_frames(images)
+        if self.deflicker:
+            frames = Deflicker(self.deflicker).correct(frames)
+        return frames
+
+    # Index of the image to start processing from, so that background subtraction and
+    #   deflickering reach the same state at first_image as when starting from the first image
+    def _warmup_start(self, first_image: int):
+        start = first_image
+        if self.subtract_background:
+            start = self._background_subtractor().warmup_start(start)
+        if self.deflicker:
+            start -= Deflicker(self.deflicker).warmup_frames
+        return max(start, 0)
+
+    def _background_subtractor(self):
+        model = self.subtract_background
+        return BackgroundSubtractor(
+            model if isinstance(model, str) else default_background_model
+        )
+
+    # Process frames in a thread pool, keeping a bounded number of frames ahead of the consumer
+    def _process_frames_parallel(self, images):
+        # Compute cached geometry once, before threads use it
+        self._affine_transform
+        self._frame_transforms
+        self._thumbnail_factor
+
+        images = iter(images)
+        pending = deque()
+        with ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="frames"
+        ) as executor:
+            try:
+                for image in islice(images, self.workers * frames_ahead_per_worker):
+                    pending.append(executor.submit(self._load_frame, image))
+                while pending:
+                    frame = pending.popleft().result()
+                    for image in islice(images, 1):
+                        pending.append(executor.submit(self._load_frame, image))
+                    yield frame
+            finally:
+                # Consumer may stop early, e.g. when preview is closed
+                for future in pending:
+                    future.cancel()
+
+    # Parameters determining the processed frame, besides the source image
+    def _cache_params(self):
+        def as_tuple(x):
+            return tuple(x) if x is not None else None
+
+        return (
+            as_tuple(self.input_resolution),
+            bool(self.input_resolution_fixed),
+            self.rotation,
+            as_tuple(self.crop),
+            bool(self.grayscale),
+            bool(self.normalize),
+            as_tuple(self.output_resolution),
+            self._thumbnail_factor,
+        )
+
+    # Processed frame from cache if available, otherwise processed and added to cache
+    def _load_frame(self, image):
+        if self.frame_cache is None:
+            return self._process_frame(image)
+        key = self.frame_cache.key(image, self._cache_params())
+        frame = self.frame_cache.get(key)
+        if frame is None:
+            frame = self._process_frame(image)
+            self.frame_cache.put(key, frame)
+        return frame
+
+    def _process_frame(self, image):
+        frame, factor = self._read_frame(image)
+        input_resolution = self.input_resolution
+        # Reduced images are rounded down when stored as thumbnails, and up when decoded reduced
+        tolerance = 0
+        if factor > 1 and input_resolution is not None:
+            input_resolution = tuple(x // factor for x in input_resolution)
+            tolerance = 1
+
+        if not self.input_resolution_fixed and any(
+            abs(x - y) > tolerance
+            for x, y in zip(frame.shape[:2], input_resolution[::-1])
+        ):
+            raise Exception(
+                f"Inconsistent pre cropped resolution: {frame.shape[:2]} vs {input_resolution[::-1]}"
+            )
+
+        frame = self._transform_frame(frame, factor)
+
+        if list(frame.shape[:2]) != list(self.output_resolution[::-1]):
+            raise Exception(
+                f"Inconsistent cropped resolution: {frame.shape[:2]} vs {self.output_resolution[::-1]:}"
             )
 
+        if self.grayscale:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+
+        if self.normalize:
+            if len(frame.shape) == 3:
+                for i in range(frame.shape[2]):
+                    frame[:, :, i] = cv2.equalizeHist(frame[:, :, i])
+            else:
+                frame = cv2.equalizeHist(frame)
+                frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+
+        return frame
+
+    # incremental: Render only images added since last render into a new segment, and
+    #   concatenate segments without re-encoding. Not available for gif
+    # outputs: Further videos rendered from the same processed frames, which are
+    #   resized to the resolution of each output, at most output_resolution
+    def render_video(
+        self,
+        video_path: Path = None,
+        preview: bool = False,
+        incremental: bool = False,
+        outputs: list[OutputSpec] = None,
+    ):
+        outputs = ([OutputSpec(video_path)] if video_path is not None else []) + list(
+            outputs or []
+        )
+        if not outputs:
+            raise ValueError("No video path or outputs given")
+        # Frames are processed once, and only scaled down for further outputs
+        for spec in outputs:
+            if spec.output_resolution is None:
+                continue
+            width, height = spec.output_resolution
+            frame_width, frame_height = self._affine_transform[1]
+            if width > frame_width or height > frame_height:
+                raise ValueError(
+                    f"Resolution {width}x{height} of {spec.video_path} exceeds "
+                    f"resolution {frame_width}x{frame_height} of processed frames"
+                )
+
+        jobs = []
+        for spec in outputs:
+            if incremental and not str(spec.video_path).endswith(".gif"):
+                job = self._incremental_job(spec)
+                if job is not None:
+                    jobs.append(job)
+            else:
+                jobs.append(_RenderJob(spec, spec.video_path))
+        if not jobs:
+            return True
+
+        success = self._render(jobs, preview)
+        for job in jobs:
+            if job.manifest is None:
+                continue
+            if not success:
+                # Discard incomplete segment, if the writer created it
+                if os.path.isfile(job.path):
+                    os.remove(job.path)
+                continue
+            job.manifest.add_segment(job.path, self.images)
+            job.manifest.concat_segments()
+            job.manifest.save()
+        return success
+
+    def _incremental_job(self, spec: OutputSpec):
+        # Before rendering, instead of failing to concatenate the rendered segment
+        require_ffmpeg()
+        manifest = RenderManifest.load(
+            spec.video_path,
+            params=[
+                self._cache_params(),
+                self._output_fps(spec),
+                spec.codec or fourcc_code,
+                self.deflicker,
+                self.subtract_background,
+                self._output_resolution(spec),
+            ],
+        )
+        new_images = manifest.new_images(self.images)
+        if not new_images:
+            print(f"No new images since last render of {spec.video_path}")
+            return None
+        print(
+            f"Rendering {len(new_images)} new images to {spec.video_path}, "
+            f"{manifest.nbr_of_images} already rendered"
+        )
+        return _RenderJob(
+            spec,
+            manifest.next_segment_path(),
+            first_image=len(self.images) - len(new_images),
+            manifest=manifest,
+        )
+
+    def _output_fps(self, spec: OutputSpec):
+        return spec.fps or self.fps
+
+    def _output_resolution(self, spec: OutputSpec):
+        return tuple(spec.output_resolution or self.output_resolution)
+
+    # Palette from frames spread over the whole video, e.g. both day and night
+    def _palette_frames(self, images):
+        sample = images[:: max(len(images) // palette_sample_size, 1)]
+        return list(self.process_frames(images=sample[:palette_sample_size]))
+
+    def _open_writer(self, job, palette_frames):
+        if str(job.path).endswith(".gif"):
+            return GIF_Writer(
+                job.path,
+                self._output_fps(job.spec),
+                self._output_resolution(job.spec),
+                palette_frames=palette_frames(),
+                workers=self.workers or 1,
+            )
+        fourcc = cv2.VideoWriter_fourcc(*(job.spec.codec or fourcc_code))
+        # fourcc = cv2.VideoWriter_fourcc(*'H264')
+        return cv2.VideoWriter(
+            str(job.path),
+            fourcc,
+            self._output_fps(job.spec),
+            self._output_resolution(job.spec),
+        )
+
+    # Each frame is processed once and written to all outputs
+    def _render(self, jobs, preview: bool):
+        # Images before the first new one are processed but not written, to warm up
+        #   background subtraction and deflickering of incremental renders
+        first_image = self._warmup_start(min(job.first_image for job in jobs))
+        images = self.images[first_image:]
+
+        palette_cache = []
+
+        def palette_frames():
+            if not palette_cache:
+                palette_cache.append(self._palette_frames(images))
+            return palette_cache[0]
+
+        writers = [self._open_writer(job, palette_frames) for job in jobs]
+
         success = True
 
-        for frame in tqdm(
-            self.process_frames(), desc="Processing images", total=len(self.images)
+        for index, frame in enumerate(
+            tqdm(
+                self.process_frames(images=images, first_image=first_image),
+                desc="Processing images",
+                total=len(images),
+            ),
+            start=first_image,
         ):
-            writer.write(frame)
+            # Resized once per resolution, shared by outputs
+            resized = {tuple(frame.shape[1::-1]): frame}
+            for job, writer in zip(jobs, writers):
+                if index < job.first_image:
+                    continue
+                resolution = self._output_resolution(job.spec)
+                if resolution not in resized:
+                    resized[resolution] = cv2.resize(
+                        frame, resolution, interpolation=cv2.INTER_AREA
+                    )
+                writer.write(resized[resolution])
 
             if preview:
                 cv2.imshow("Preview", frame)
@@ -166,7 +612,8 @@ class VideoTemplate:
                     success = False
                     break
 
-        writer.release()
+        for writer in writers:
+            writer.release()
         if preview:
             cv2.destroyAllWindows()
         return success